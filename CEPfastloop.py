@@ -24,26 +24,52 @@ version history:
 """
 
 import sys
+import argparse
 from PyQt4 import QtGui, QtCore
 import numpy as np
 import pyqtgraph as pg
 import time
-from adafruit_ads1x15 import ads1x15
-import serial
+from adc_reader import ADCReader
+from ringbuffer import RingBuffer
+from picomotor import PicomotorQueue
+from binlog import BinaryLogger, HISTORY
+from cep_backend import HardwareBackend, SimulatedBackend
+from wedge_control import BangBangController, PIController
+from looptiming import LoopTimer, timing_path
+
+def minmax_decimate(y, width):
+    """ x (indices into y) and y of a curve looking like y at width pixels: the min
+    and max of each of width bins, so spikes survive. Short curves are returned as is """
+    n = len(y)
+    if n <= 2*width:
+        return np.arange(n), y
+    edges = np.linspace(0, n, width + 1).astype(int)
+    x = np.column_stack([edges[:-1], edges[1:] - 1]).ravel()
+    y = np.column_stack([np.minimum.reduceat(y, edges[:-1]), np.maximum.reduceat(y, edges[:-1])]).ravel()
+    return x, y
 
 class CEPfastloop(QtGui.QWidget):
     
-    def __init__(self):
+    def __init__(self, backend=None, log_dir=None):
         super(CEPfastloop, self).__init__()
+        # where the ADC and the picomotor serial port come from, see cep_backend
+        self.backend = backend
+        # directory of the daily logs, the backend's log_dir by default
+        self.log_dir = log_dir
         self.initUI()
 
         
     def initUI(self):
         self.ADC_Nsamples      = 50
-        self.hist_length       = 500
-        self.testing           = 0    # if 1 testing with fake data and fake wedge, =0 read ADS1015 and talk to picomotor over serial
-        self.feedbackactive    = 0
-        self.feedbackstepsize  = 20   # bigger = more distrubance to oscillator but faster convergence of feedback 10 to 20 is ideal
+        self.hist_length       = 500  # ticks shown in the history plots
+        self.hist_capacity     = 12*3600*10 # ticks of history kept, a 12 h shift at 10 Hz
+        self.tick_interval     = 100  # [ms] control tick
+        self.plot_interval     = 500  # [ms] between redraws, independent of the 100 ms control tick
+        self.timing_save_ticks = 600  # ticks between exports of the loop timing histograms
+        self.testing           = 0    # if 1 testing against the simulated plant (unless a backend was given), =0 read ADS1015 and talk to picomotor over serial
+        self.feedbackstepsize  = 20   # bang-bang: bigger = more distrubance to oscillator but faster convergence of feedback 10 to 20 is ideal
+        self.controllers       = {'bang-bang': BangBangController(stepsize=self.feedbackstepsize, burst=15),
+                                  'PI': PIController(kp=0.2, ki=0.02, deadband=20, max_steps=50)} # steps/mV, steps/mV/s, mV, steps per tick
         self.pico_acceleration = 150  # [setps/s^2] <<1000 is best for not distrubing CEP lock
         self.pico_min_velocity = 0    # [Hz]
         self.pico_max_velocity = 2000 # [Hz]
@@ -147,10 +173,16 @@ class CEPfastloop(QtGui.QWidget):
         #spacer = QtGui.QLabel('   ', self)
         #vb.addWidget(spacer)
 
-        #fbhb = QtGui.QHBoxLayout()
+        fbhb = QtGui.QHBoxLayout()
         self.fb = QtGui.QCheckBox('enable feedback', self)
         self.fb.setCheckable(True)
-        vb.addWidget(self.fb)
+        fbhb.addWidget(self.fb)
+        self.controllerCB = QtGui.QComboBox(self)
+        self.controllerCB.addItem("bang-bang")
+        self.controllerCB.addItem("PI")
+        self.controllerCB.activated.connect(self.controllerset)
+        fbhb.addWidget(self.controllerCB)
+        vb.addLayout(fbhb)
 
         self.AOMinfo = QtGui.QLabel('info here', self)
         vb.addWidget(self.AOMinfo)
@@ -160,6 +192,10 @@ class CEPfastloop(QtGui.QWidget):
         self.fbinfo.setMinimumWidth(100)
         vb.addWidget(self.fbinfo)
 
+        self.timinginfo = QtGui.QLabel(' ', self)
+        self.timinginfo.setStyleSheet("font-family: monospace; font-size: 9pt; font-weight: normal")
+        vb.addWidget(self.timinginfo)
+
         #spacer = QtGui.QLabel('   ', self)
         #fbhb.addWidget(spacer)
         #vb.addLayout(fbhb)
@@ -200,6 +236,7 @@ class CEPfastloop(QtGui.QWidget):
         vb.addLayout(vbhb)
 
         self.timer = QtCore.QBasicTimer()
+        self.plottimer = QtCore.QBasicTimer()
         
         #self.setGeometry(300, 300, 500, 400)
         self.setWindowTitle('CEPfastloop')
@@ -212,44 +249,38 @@ class CEPfastloop(QtGui.QWidget):
         self.setPlotInfo()
         
         self.AOMvoltage = self.setpoint.value() + np.random.normal(size=(self.ADC_Nsamples,))
+        self.adcreader = None
         self.iter = 0
         self.wedgestepsizeset()
+        self.controllerset()
         
-        self.hist_time      = np.zeros(self.hist_length,)
-        self.hist_wedgesteps = np.zeros(self.hist_length,)
-        self.hist_aomvolts   = np.zeros(self.hist_length,)
-
-        # start serial port:
-        self.ser = serial.Serial("/dev/ttyUSB0", baudrate=19200, timeout=3.0)
-        time.sleep(1)
-        self.ser.write("INI\r\n")
-        for picoinin in range(0,10):
-            print("initialising picomotor controller %0.0f %%" % (100. * picoinin/10.0))
-            time.sleep(1)
-       
-        self.ser.write("ECHO OFF\r\n")
-        time.sleep(1)
-        print("initialising picomotor controller %0.0f %%" % (100))
-
-        print("picomotor controller: setting channel A1 motor 0")
-        self.ser.write("CHL A1=0\r\n")
-        time.sleep(0.5)
-        print("picomotor controller: setting acceleration to %i steps/s^2" % (self.pico_acceleration))
-        self.ser.write("ACC A1 0=%i\r\n" % self.pico_acceleration) # 16 20000 steps/s^2 set acceleration
-        time.sleep(0.5)
-        print("picomotor controller: setting min velocity to %i Hz" % (self.pico_min_velocity))
-        self.ser.write("MPV A1 0=%i\r\n" % self.pico_min_velocity) # 0 1999 Hz set minimum profile velocity
-        time.sleep(0.5)
-        print("picomotor controller: setting max velocity to %i Hz" % (self.pico_max_velocity))
-        self.ser.write("VEL A1 0=%i\r\n" % self.pico_max_velocity) # 1 2000 Hz set velocity
-        time.sleep(0.5)
-        print("picomotor ready")
+        self.history = RingBuffer(self.hist_capacity, dtype=HISTORY)
+        self.history.extend(np.zeros(self.hist_length, dtype=HISTORY))
+        if self.backend is None:
+            self.backend = SimulatedBackend() if self.testing == 1 else HardwareBackend("/dev/ttyUSB0")
+
+        # one binary log file per day, read back with binlog.read_log
+        self.logger = BinaryLogger(self.log_dir or self.backend.log_dir, HISTORY)
+        # per stage durations and tick jitter, exported next to the log
+        self.looptimer = LoopTimer(self.tick_interval / 1000.)
+        self.wedgesteps = 0.
+        self.AOMvoltageMean = np.mean(self.AOMvoltage)
+
+        # start serial port, all picomotor traffic goes through the command queue thread
+        self.ser = self.backend.serial_port()
+        self.pico = PicomotorQueue(self.ser, channel='A1')
+        self.pico.init_delay = self.backend.init_delay
+        print("initialising picomotor controller: channel A1 motor 0, acceleration %i steps/s^2, velocity %i to %i Hz"
+              % (self.pico_acceleration, self.pico_min_velocity, self.pico_max_velocity))
+        self.pico_ready = self.pico.initialise(self.pico_acceleration, self.pico_min_velocity, self.pico_max_velocity)
+        self.pico_ready.add_done_callback(self.picoReady)
         
         #self.show() # normal window
         self.showFullScreen()# fuillscreen window
 
         # start the AOM reader timer loop
         self.readADCstartstop()
+        self.plottimer.start(self.plot_interval, self)
         
         self.plt.setYRange(0,1000)
         self.plt2.setXRange(0,self.hist_length)
@@ -258,102 +289,130 @@ class CEPfastloop(QtGui.QWidget):
 
         
     def timerEvent(self, ee):
-        self.hist_time = np.roll(self.hist_time,-1)
-        self.hist_time[-1] = time.time()
-
-        #self.hist_time_str = np.roll(self.hist_time_str,-1)
-        #self.hist_time_str[-1] = time.strftime("%a, %d %b %Y %H:%M:%S +0000" , time.gmtime() )
-
-        self.hist_aomvolts     = np.roll(self.hist_aomvolts,-1)
-        self.hist_aomvolts[-1] = self.hist_aomvolts[-2]
-
-        self.hist_wedgesteps = np.roll(self.hist_wedgesteps,-1)
-        self.hist_wedgesteps[-1] = self.hist_wedgesteps[-2]
-       
+        if ee.timerId() == self.plottimer.timerId():
+            self.looptimer.measure('plotting', self.plotting)
+            return
+        self.looptimer.tick()
+        now = time.time()
+        self.tick_dt = now - self.tick_time
+        self.tick_time = now
         self.iter = self.iter + 1.
         
         self.readADC()
+        self.looptimer.lap('readADC')
         self.feedback()
+        self.looptimer.lap('feedback')
         self.setAOMinfo()
-        self.plotting()
+        self.looptimer.lap('setAOMinfo')
+        # one history record per tick, O(1) whatever hist_capacity is
+        self.history.append((now, self.AOMvoltageMean, self.wedgesteps))
         self.logging()
+        self.looptimer.lap('logging')
 
 
     def readADC(self):
-        if self.testing == 1:
-            self.AOMvoltage = np.mean(self.AOMvoltage) + 10 * np.random.normal(size=(self.ADC_Nsamples,)) + 5*np.sin(self.iter*0.05)
-        elif self.testing == 0:
-            # read AOM voltage via Adafruit ADS1015
-            for n in range(0,self.ADC_Nsamples):
-                #volts = adc.readADCSingleEnded(0, 1024, 3300) / 1000
-                volts = self.adc.readADCDifferential(0,1, 6144, 3300) / 1000
-                #volts=adc.getLastConversionResults()/1000
-                self.AOMvoltage[n] = volts * 1000. +830.
+        # the reader thread samples the ADC continuously, take everything that
+        # came in since the last tick (at least ADC_Nsamples for the mean)
+        samples, self.adc_count = self.adcreader.samples.since(self.adc_count)
+        if len(samples) < self.ADC_Nsamples:
+            samples = self.adcreader.samples.latest(self.ADC_Nsamples)
+        if len(samples):
+            self.AOMvoltage = samples['mV']
                 
         self.AOMvoltageMean    = np.mean(self.AOMvoltage)
-        #self.hist_aomvolts     = np.roll(self.hist_aomvolts,-1)
-        self.hist_aomvolts[-1] = self.AOMvoltageMean
         
         
     def readADCstartstop(self):
         if self.timer.isActive():
             self.timer.stop()
+            self.stopADCreader()
             self.btn.setText('Start ADC')
         else:
-            self.adc = ads1x15(ic=0x00)
-            self.timer.start(100, self)
+            self.adc = self.backend.adc()
+            self.adcreader = ADCReader(self.adc)
+            self.adc_count = 0
+            self.adcreader.start()
+            self.tick_time = time.time()
+            self.timer.start(self.tick_interval, self)
             self.btn.setText('Stop ADC')
+
+    def stopADCreader(self):
+        if self.adcreader is not None:
+            self.adcreader.stop()
+            self.adcreader = None
+
+    def picoReady(self, future):
+        # called from the picomotor queue thread
+        if future.exception() is None:
+            print("picomotor ready")
+        else:
+            print("picomotor setup failed: %s" % future.exception())
+
+    def closeEvent(self, event):
+        self.stopADCreader()
+        self.pico.stop()
+        self.logger.stop()
+        self.saveTiming()
+        self.backend.close()
+        event.accept()
         
                 
     def logging(self):
-        if self.iter >= self.hist_length:
-            self.iter = 0
-            print("logging data to file")
-            with open('/home/pi/CEPfastloop.log','a') as f_handle:
-                np.savetxt(f_handle, (np.transpose([self.hist_time, self.hist_aomvolts, self.hist_wedgesteps])), delimiter=', ', fmt='%.23f, %.1f, %i')
+        # queue this tick's record, the logger thread writes them in batches
+        self.logger.log(self.history.latest(1))
+        if self.iter % self.timing_save_ticks == 0:
+            self.saveTiming()
+
+    def saveTiming(self):
+        # histograms since the start of the program, into the file of the day
+        day = time.strftime('%Y-%m-%d')
+        try:
+            self.looptimer.save(timing_path(self.logger.directory, day))
+        except (IOError, OSError) as e:
+            print("saving the loop timing failed: %s" % e)
 
 
     def plotting(self):
-        self.plt_AOMvoltage.setData(self.AOMvoltage)
-        self.plt_aomhistory.setData(   self.hist_aomvolts)
-        self.plt_wedgehistory.setData( self.hist_wedgesteps)
+        # runs on its own timer, nothing is drawn while the window is not on screen
+        if not self.isVisible() or self.isMinimized():
+            return
+        if self.plt.isVisible():
+            self.plt_AOMvoltage.setData(self.AOMvoltage)
+        hist = self.history.view(self.hist_length) # no copy
+        # at most two points per pixel column, whatever hist_length is
+        width = max(self.plt2.width(), 1)
+        self.plt_aomhistory.setData(   *minmax_decimate(hist['aomvolts'], width))
+        self.plt_wedgehistory.setData( *minmax_decimate(hist['wedgesteps'], width))
+        self.timinginfo.setText(self.looptimer.summary())
         #self.plt_aomhistory.setData(   x=self.hist_time-self.hist_time[0], y=self.hist_aomvolts)
         #self.plt_wedgehistory.setData( x=self.hist_time-self.hist_time[0], y=self.hist_wedgesteps)
         #print "iter: %i" % (self.iter)
 
     def feedback(self):
-        if self.fb.isChecked():
-            if self.AOMvoltageMean >= self.setpoint.value() + self.lockrange.value():
-                self.feedbackactive = -15
-            if self.AOMvoltageMean <= self.setpoint.value() - self.lockrange.value():
-                self.feedbackactive = 15
-        elif not self.fb.isChecked():
+        if not self.fb.isChecked():
+            self.controller.reset()
             self.stopfeedback()
-            #self.hist_wedgesteps = np.roll(self.hist_wedgesteps,-1)
-            #self.hist_wedgesteps[-1] = self.hist_wedgesteps[-2]
-
-        # we want the wedge to be moved until the AOM voltage reached the setpoint again
-        # otherwise the voltage will hover at the max or min of the lockrange and feedback is constantly on and distrubing the oscillator
-        if self.feedbackactive > 0 :
-            self.feedbackactive = self.feedbackactive - 1
-            self.wedgemover(self.feedbackstepsize)
+            return
+        error = self.setpoint.value() - self.AOMvoltageMean
+        steps = self.controller.update(error, self.lockrange.value(), self.tick_dt)
+        if steps > 0:
+            self.wedgemover(steps)
             self.fbinfo.setText("moving wedge in")
             self.fbinfo.setStyleSheet("color: orange")
-            if self.AOMvoltageMean > self.setpoint.value() :
-                self.stopfeedback()
-        if self.feedbackactive < 0 :
-            self.feedbackactive = self.feedbackactive + 1
-            self.wedgemover(-self.feedbackstepsize)
+        elif steps < 0:
+            self.wedgemover(steps)
             self.fbinfo.setText("moving wedge out")
             self.fbinfo.setStyleSheet("color: orange")
-            if self.AOMvoltageMean < self.setpoint.value() :
-                self.stopfeedback()
-        if self.feedbackactive == 0:
+        else:
             self.stopfeedback()
-            #self.hist_wedgesteps[-1] = self.hist_wedgesteps[-2]
+
+    def controllerset(self):
+        name = str(self.controllerCB.currentText())
+        self.controller = self.controllers[name]
+        self.controller.reset()
+        print("feedback controller set to: %s" % (name))
     
     def stopfeedback(self):
-        self.feedbackactive = 0
         self.fbinfo.setText("not moving")
         self.fbinfo.setStyleSheet("color: green")
         
@@ -408,7 +467,7 @@ class CEPfastloop(QtGui.QWidget):
     def wedgemover(self, steps):
         #print "moving wedge by %i steps" % (steps)
         #self.hist_wedgesteps = np.roll(self.hist_wedgesteps,-1)
-        self.hist_wedgesteps[-1] = self.hist_wedgesteps[-2] + steps #log step history
+        self.wedgesteps = self.wedgesteps + steps #log step history
         # TODO add code to talk to picomotor via serial port here
         #self.AOMvoltage = self.AOMvoltage + steps  # this is jsut to fake a wedge move
 
@@ -420,10 +479,8 @@ class CEPfastloop(QtGui.QWidget):
         #time.sleep(0.1)
 
 
-        self.ser.write("REL A1 %i\r\n" % steps)
-        time.sleep(0.1)
-        self.ser.write("GO\r\n")
-        time.sleep(0.1)
+        # queued, the moves waiting behind each other go out as one
+        self.pico.move(steps)
 
         #this is the old code for remote feedback via FIACS on pointium
         #fn = '/home/pi/mnt_pointium/newfocuspicomotor_request_' + str(steps)
@@ -433,7 +490,12 @@ class CEPfastloop(QtGui.QWidget):
 
 def main():
     app = QtGui.QApplication(sys.argv)
-    ex = CEPfastloop()
+    parser = argparse.ArgumentParser(description="CEP fastloop wedgemover feedback")
+    parser.add_argument('--simulate', action='store_true',
+                        help="run against the simulated plant, no hardware needed")
+    parser.add_argument('--log-dir', help="directory of the daily logs")
+    args = parser.parse_known_args(sys.argv[1:])[0]  # Qt's own options pass through
+    ex = CEPfastloop(SimulatedBackend() if args.simulate else None, log_dir=args.log_dir)
     sys.exit(app.exec_())
 
 
@@ -0,0 +1,48 @@
+"""
+Background acquisition of the AOM voltage for CEPfastloop.
+
+The ADS1015 is read in a loop on its own thread, as fast as the I2C bus and the
+conversion rate allow, into a RingBuffer of (time, mV) samples. The GUI and the
+feedback take whatever arrived since their last look, so neither a slow redraw nor
+a stalled bus holds the other up.
+"""
+
+import time
+import threading
+from ringbuffer import RingBuffer
+
+SAMPLE = [('time', 'f8'), ('mV', 'f8')]
+
+
+class ADCReader(threading.Thread):
+    """ Reads the differential channel 0-1 of adc into samples, a RingBuffer of
+    capacity SAMPLE records, until stop is called. pga and sps go to
+    readADCDifferential; offset (mV) is added to every reading """
+
+    def __init__(self, adc, capacity=2**16, pga=6144, sps=3300, offset=830.):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.adc = adc
+        self.pga = pga
+        self.sps = sps
+        self.offset = offset
+        self.samples = RingBuffer(capacity, dtype=SAMPLE)
+        self.errors = 0     # failed bus reads
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                volts = self.adc.readADCDifferential(0, 1, self.pga, self.sps) / 1000
+            except IOError:
+                # a stalled bus only costs samples, try again shortly
+                self.errors += 1
+                time.sleep(0.01)
+                continue
+            self.samples.append((time.time(), volts * 1000. + self.offset))
+
+    def stop(self, timeout=1.0):
+        """ End the read loop and wait for the thread """
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
@@ -0,0 +1,137 @@
+"""
+Offline benchmark of the CEPfastloop wedge controllers.
+
+    python bench_feedback.py                                  # simulated plant, 1 h
+    python bench_feedback.py --drift 0.2 --duration 7200
+    python bench_feedback.py --log-dir /home/pi/CEPfastloop_logs --day 2016-03-14
+
+Every controller of wedge_control runs the same closed loop as CEPfastloop, one
+update per 100 ms tick on the mean of the ADC samples of the tick, much faster than
+real time. It runs either against the WedgePlant of cep_backend on a ManualClock, or
+replays a recorded log. For a replay, the disturbance the wedge compensated (drift,
+lock noise) is recovered from the log by subtracting gain times the recorded wedge
+position, the gain being fitted to the recorded moves unless given. The controller
+then moves a simulated wedge against that disturbance. Reported per controller:
+
+    settling   s until the voltage entered the lockrange for good (nan if it never did)
+    in lock    fraction of the ticks within the lockrange
+    travel     total wedge travel in steps
+    moves      ticks on which the wedge moved
+    rms        rms error from the setpoint, mV
+"""
+
+import sys
+import argparse
+import numpy as np
+from binlog import HISTORY, read_log
+from cep_backend import WedgePlant, ManualClock
+from wedge_control import BangBangController, PIController
+
+
+class LogPlant(WedgePlant):
+    """ Plant replaying the disturbance recorded in a log: the voltage of the log with
+    the effect of its wedge moves (gain mV/step) taken out, plus that of ours """
+
+    def __init__(self, log, gain, latency=0.3, velocity=2000.):
+        clock = ManualClock()
+        WedgePlant.__init__(self, gain=gain, latency=latency, velocity=velocity,
+                            noise=0., drift=0., clock=clock)
+        self.times = log['time'] - log['time'][0]
+        self.disturbance = log['aomvolts'] - gain * (log['wedgesteps'] - log['wedgesteps'][0])
+
+    def voltage(self, t=None):
+        t = self.clock() if t is None else t
+        return np.interp(t, self.times, self.disturbance) + self.gain * self.position(t - self.latency)
+
+
+def estimate_gain(log, delay=4, window=20):
+    """ mV per wedge step, least squares of the voltage change over window ticks
+    against the wedge moves of the same ticks delay earlier (the latency of the
+    plant plus the tick the move went out on) """
+    volts = log['aomvolts'][delay+window:] - log['aomvolts'][delay:-window]
+    steps = log['wedgesteps'][window:-delay] - log['wedgesteps'][:-delay-window]
+    if not np.any(steps):
+        raise ValueError("the log has no wedge moves to fit the gain to")
+    return np.sum(steps * volts) / np.sum(steps ** 2)
+
+
+def run_loop(controller, plant, setpoint, lockrange, duration, tick=0.1, nsamples=50):
+    """ Closed loop of controller on plant (on a ManualClock) for duration s of plant
+    time, returns the history as HISTORY records """
+    clock = plant.clock
+    controller.reset()
+    n = int(duration / tick)
+    history = np.zeros(n, dtype=HISTORY)
+    wedge = 0.
+    for i in range(n):
+        start = clock()
+        mean = np.mean(plant.voltage(start + tick * np.arange(nsamples) / nsamples))
+        clock.advance(tick)
+        steps = controller.update(setpoint - mean, lockrange, tick)
+        if steps:
+            plant.move(steps)
+            wedge += steps
+        history[i] = (clock(), mean, wedge)
+    return history
+
+
+def metrics(history, setpoint, lockrange):
+    """ settling time, time in lock, wedge travel, moves and rms error of a history """
+    error = history['aomvolts'] - setpoint
+    out = np.abs(error) >= lockrange
+    t = history['time'] - history['time'][0]
+    if out[-1]:
+        settling = np.nan
+    elif out.any():
+        settling = t[np.nonzero(out)[0][-1] + 1]
+    else:
+        settling = 0.
+    moves = np.diff(np.concatenate([[0], history['wedgesteps']]))
+    return {'settling': settling,
+            'in lock': 1 - np.mean(out),
+            'travel': np.sum(np.abs(moves)),
+            'moves': np.count_nonzero(moves),
+            'rms': np.sqrt(np.mean(error ** 2))}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--setpoint', type=float, default=500.)
+    parser.add_argument('--lockrange', type=float, default=100.)
+    parser.add_argument('--duration', type=float, default=3600., help="s, simulated plant only")
+    parser.add_argument('--start', type=float, default=650., help="mV at the start, simulated plant only")
+    parser.add_argument('--drift', type=float, default=0.05, help="mV/s, simulated plant only")
+    parser.add_argument('--noise', type=float, default=5., help="mV rms, simulated plant only")
+    parser.add_argument('--gain', type=float, default=None, help="mV/step, fitted to a log by default")
+    parser.add_argument('--latency', type=float, default=0.3)
+    parser.add_argument('--log-dir')
+    parser.add_argument('--day', help="YYYY-MM-DD of the log to replay")
+    args = parser.parse_args(argv)
+    if args.day and not args.log_dir:
+        parser.error("--day needs --log-dir, the directory of the log to replay")
+
+    controllers = [BangBangController(), PIController()]
+    print("%-10s %10s %8s %8s %6s %8s" % ('controller', 'settling', 'in lock', 'travel', 'moves', 'rms'))
+    for controller in controllers:
+        if args.day:
+            log = np.array(read_log(args.log_dir, args.day))
+            gain = estimate_gain(log) if args.gain is None else args.gain
+            plant = LogPlant(log, gain, latency=args.latency)
+            nsamples = 1    # the log holds the tick means already
+            duration = plant.times[-1]
+        else:
+            plant = WedgePlant(v0=args.start, gain=0.5 if args.gain is None else args.gain,
+                               drift=args.drift, noise=args.noise, latency=args.latency,
+                               clock=ManualClock(), seed=0)
+            nsamples = 50
+            duration = args.duration
+        history = run_loop(controller, plant, args.setpoint, args.lockrange, duration,
+                           nsamples=nsamples)
+        m = metrics(history, args.setpoint, args.lockrange)
+        print("%-10s %9.1fs %7.1f%% %8i %6i %6.1fmV" % (
+            controller.name, m['settling'], 100 * m['in lock'], m['travel'], m['moves'], m['rms']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,269 @@
+"""
+Benchmark and accuracy regression suite of the cylinder ferromagnet field solver in
+h_field_strength.
+
+    python bench_field.py                     # timings up to 10^6 points + accuracy
+    python bench_field.py --max-points 1e7    # up to 10^7, chunked above 10^6
+    python bench_field.py --update-reference  # accept the current solver output
+
+Timings and peak memory (numpy allocations, via tracemalloc) are reported for point
+counts from 10^2 up in four regimes: inside the magnet, outside it, near the rim and
+on the axis. Batches above 10^6 points go through field_parallel, one call of the
+plain solver would need several GB of temporaries. Their peak memory is printed as
+n/a: it sits in the worker processes and the shared output map, which tracemalloc in
+this process does not see.
+
+The accuracy check compares the basis fields of the solver with a direct numerical
+integration of the Coulomb integral of the surface charges, M on the top face, -M on
+the bottom face for the axial magnetisation and M cos(phi) on the side for the
+in-plane one. The reference values and the accepted solver output at 32 points per
+regime are kept in bench_field_reference.json. The comparison is point by point: the
+run fails if the error against the reference grew at any point, or if the output
+changed from the accepted one by more than the tolerance, unless --update-reference
+accepts it (delete the file to integrate the reference anew). It also checks the
+table, chunked, gradient, compiled (numba), angle-recombination and float32 paths
+against the plain solver.
+
+The special-function call count of one solver call is printed as well.
+"""
+
+import os
+import sys
+import json
+import time
+import types
+import argparse
+import tracemalloc
+import numpy as np
+import scipy.special as spc
+from scipy import integrate
+import h_field_strength
+from h_field_strength import CylinderMagnet, combine_basis
+
+ELLIPTIC = ('ellipk', 'ellipe', 'ellipkinc', 'ellipeinc')
+REGIMES = ('interior', 'exterior', 'near_rim', 'on_axis')
+REFERENCE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'bench_field_reference.json')
+
+
+def count_special_calls(x, y, z):
+    """ number of calls to each elliptic integral made by one solver call """
+    counts = dict.fromkeys(ELLIPTIC, 0)
+
+    def counting(name):
+        func = getattr(spc, name)
+        def wrapper(*args):
+            counts[name] += 1
+            return func(*args)
+        return wrapper
+
+    h_field_strength.spc = types.SimpleNamespace(**{name: counting(name) for name in ELLIPTIC})
+    try:
+        h_field_strength.H_spherical_ferromag(x, y, z)
+    finally:
+        h_field_strength.spc = spc
+    return counts
+
+
+def regime_points(regime, n, a=1., h=1., seed=0):
+    """ n random points of one regime around a magnet of radius a and thickness h """
+    rng = np.random.default_rng(seed)
+    if regime == 'interior':
+        r = a*np.sqrt(rng.uniform(0.01, 0.9, n))
+        z = rng.uniform(-0.95*h, -0.05*h, n)
+    elif regime == 'exterior':
+        r = rng.uniform(0.1*a, 3*a, n)
+        z = rng.choice([-1, 1], n)*rng.uniform(0.2*a, 2*a, n)
+        z = np.where(z < 0, z-h, z)
+    elif regime == 'near_rim':
+        d = a*rng.uniform(0.01, 0.05, n)
+        angle = rng.uniform(0, 2*np.pi, n)
+        r = a+d*np.cos(angle)
+        z = d*np.sin(angle)-h*rng.integers(0, 2, n)
+    elif regime == 'on_axis':
+        r = np.zeros(n)
+        z = rng.uniform(-h-2*a, 2*a, n)
+    else:
+        raise ValueError("unknown regime %r" % regime)
+    phi = rng.uniform(0, 2*np.pi, n)
+    return r*np.cos(phi), r*np.sin(phi), z
+
+
+def reference_basis(x, y, z, a=1., h=1., tol=1e-10):
+    """ (axial, in-plane) fields of unit magnetisation along z and x at one point, by
+    numerical integration of the surface charges """
+    def face(zf, sign, c):
+        def f(phi, rp):
+            d = np.array([x-rp*np.cos(phi), y-rp*np.sin(phi), z-zf])
+            return sign*rp*d[c]/np.dot(d, d)**1.5
+        return integrate.dblquad(f, 0, a, 0, 2*np.pi, epsabs=tol, epsrel=tol)[0]
+
+    def side(c):
+        def f(phi, zp):
+            d = np.array([x-a*np.cos(phi), y-a*np.sin(phi), z-zp])
+            return a*np.cos(phi)*d[c]/np.dot(d, d)**1.5
+        return integrate.dblquad(f, -h, 0, 0, 2*np.pi, epsabs=tol, epsrel=tol)[0]
+
+    # the charges give H directly, i.e. B-4piM inside the magnet
+    axial = [face(0, 1, c)+face(-h, -1, c) for c in range(3)]
+    inplane = [side(c) for c in range(3)]
+    return axial, inplane
+
+
+def solver_basis(magnet, x, y, z):
+    """ (axial, in-plane) fields of the solver, shape (2, 3, n) """
+    basis = magnet.field_basis(x, y, z)/magnet.m
+    return np.array([basis[2], basis[0]])
+
+
+def time_call(func, repeat=3):
+    """ best wall time of repeat calls, in seconds """
+    best = np.inf
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter()-t0)
+    return best
+
+
+def peak_memory(func):
+    """ peak numpy/python allocation of one call, in bytes """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_timings(max_points=10**6, chunked_above=10**6):
+    """ print time, throughput and peak memory per regime and point count """
+    from field_parallel import field_parallel
+    print("%-9s %9s %10s %12s %10s" % ('regime', 'points', 'time (s)', 'points/s', 'peak (MB)'))
+    n = 100
+    while n <= max_points:
+        for regime in REGIMES:
+            x, y, z = regime_points(regime, n)
+            repeat = 3 if n <= 10**5 else 1
+            if n > chunked_above:
+                t = time_call(lambda: field_parallel(x, y, z), repeat)
+                peak = 'n/a'
+            else:
+                call = lambda: h_field_strength.H_spherical_ferromag(x, y, z)
+                t = time_call(call, repeat)
+                peak = "%.1f" % (peak_memory(call)/2.**20)
+            print("%-9s %9i %10.4f %12.3e %10s" % (regime, n, t, n/t, peak))
+        n *= 10
+
+
+def build_reference(n=32):
+    """ reference integrals and the current solver output at n points per regime """
+    magnet = CylinderMagnet(1, 1., 1.)
+    data = {'a': 1., 'h': 1., 'regimes': {}}
+    for regime in REGIMES:
+        x, y, z = regime_points(regime, n, seed=1)
+        ref = [reference_basis(*p) for p in zip(x, y, z)]
+        data['regimes'][regime] = {
+            'points': np.transpose([x, y, z]).tolist(),
+            'reference': np.transpose(ref, (1, 2, 0)).tolist(),
+            'solver': solver_basis(magnet, x, y, z).tolist()}
+    return data
+
+
+def check_accuracy(data, tol=1e-9):
+    """ compare the solver with the stored reference point by point; False if the
+    error grew at any point or the output changed from the accepted one """
+    magnet = CylinderMagnet(1, data['a'], data['h'])
+    ok = True
+    print("%-9s %6s %14s %14s %14s" % ('regime', 'points', 'err accepted', 'err now', 'output change'))
+    for regime in REGIMES:
+        entry = data['regimes'][regime]
+        x, y, z = np.transpose(entry['points'])
+        ref = np.array(entry['reference'])
+        accepted = np.array(entry['solver'])
+        now = solver_basis(magnet, x, y, z)
+        err_accepted = abs(accepted-ref)
+        err_now = abs(now-ref)
+        change = abs(now-accepted)/(1+abs(accepted))
+        print("%-9s %6i %14.3e %14.3e %14.3e" % (regime, len(x), np.nanmax(err_accepted),
+                                                 np.nanmax(err_now), np.nanmax(change)))
+        # nan (the solver's own singular points) has to stay nan
+        grew = ~(err_now <= err_accepted*(1+tol)+tol) & ~(np.isnan(now) & np.isnan(accepted))
+        changed = ~(change <= tol) & ~(np.isnan(now) & np.isnan(accepted))
+        if np.any(grew):
+            print("  FAIL: the error against the reference grew at %i of %i points"
+                  % (np.count_nonzero(grew.any(axis=(0, 1))), len(x)))
+            ok = False
+        if np.any(changed):
+            print("  FAIL: the solver output changed at %i of %i points, run with "
+                  "--update-reference to accept" % (np.count_nonzero(changed.any(axis=(0, 1))), len(x)))
+            ok = False
+    return ok
+
+
+def check_fast_paths(n=20000):
+    """ max deviation of the table, chunked, gradient, compiled, recombination and
+    float32 paths from the solver """
+    from field_parallel import field_parallel
+    from field_table import FieldTable
+    from field_gradient import field_gradient
+    import field_numba
+    magnet = CylinderMagnet(1, 1., 1., np.pi/4)
+    x, y, z = np.concatenate([regime_points(regime, n//4) for regime in REGIMES], axis=1)
+    exact = np.array(magnet.field(x, y, z))
+    table = FieldTable.cached(1., 1.)
+    paths = [('field_parallel', np.array(field_parallel(x, y, z, magnet=magnet, workers=1)), 1e-12),
+             ('field_gradient', field_gradient(x, y, z, magnet)[0], 1e-12),
+             # Carlson's elliptic integrals round differently from scipy's
+             ('field_numba', np.array(field_numba.field(magnet, x, y, z)),
+              1e-12*(1+np.nanmax(abs(exact)))),
+             ('combine_basis', combine_basis(magnet.field_basis(x, y, z), np.pi/4), 1e-12),
+             ('FieldTable', table.field(x, y, z, theta=np.pi/4), table.error_bound),
+             # the float32 bound of CylinderMagnet.field for points near the rim
+             ('float32', np.array(magnet.field(x, y, z, dtype=np.float32), dtype=float),
+              3e-3*max(magnet.m, np.nanmax(abs(exact))))]
+    ok = True
+    for name, H, bound in paths:
+        dev = np.nanmax(abs(H-exact))
+        print("%-15s max deviation %.3e (allowed %.3e)" % (name, dev, bound))
+        ok = ok and dev <= bound
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--max-points', type=float, default=1e6)
+    parser.add_argument('--update-reference', action='store_true')
+    parser.add_argument('--skip-timings', action='store_true')
+    args = parser.parse_args(argv)
+
+    x, y, z = regime_points('exterior', 10)
+    counts = count_special_calls(x, y, z)
+    print("special-function calls per solver call: " +
+          ", ".join("%s %i" % (name, counts[name]) for name in ELLIPTIC) +
+          ", total %i" % sum(counts.values()))
+    if not args.skip_timings:
+        run_timings(int(args.max_points))
+
+    if args.update_reference or not os.path.exists(REFERENCE_FILE):
+        if os.path.exists(REFERENCE_FILE):
+            with open(REFERENCE_FILE) as f:
+                data = json.load(f)
+            magnet = CylinderMagnet(1, data['a'], data['h'])
+            for entry in data['regimes'].values():
+                entry['solver'] = solver_basis(magnet, *np.transpose(entry['points'])).tolist()
+        else:
+            print("integrating the reference fields, this takes a while")
+            data = build_reference()
+        with open(REFERENCE_FILE, 'w') as f:
+            json.dump(data, f)
+        print("reference written to %s" % REFERENCE_FILE)
+    with open(REFERENCE_FILE) as f:
+        data = json.load(f)
+    ok = check_accuracy(data)
+    ok = check_fast_paths() and ok
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
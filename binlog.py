@@ -0,0 +1,116 @@
+"""
+Append-only binary logging for CEPfastloop.
+
+Records (any fixed numpy record dtype with a 'time' field in seconds since the epoch)
+are queued by the caller and written by a background thread in batches, one write
+per flush_interval, into one .npy file per day, <prefix>_YYYY-MM-DD.npy. The header
+is rewritten in place after each batch, so the files load with np.load; a crash
+between the two writes only leaves the header short, and read_log sizes the data
+from the file length instead:
+
+    log = read_log('/home/pi/CEPfastloop_logs', '2016-03-14')   # memory-mapped
+    plot(log['time'], log['aomvolts'])
+"""
+
+import os
+import time
+import threading
+import numpy as np
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+HEADER_LEN = 256    # bytes reserved for the .npy header of a segment
+# the tick records of CEPfastloop's history and log
+HISTORY = [('time', 'f8'), ('aomvolts', 'f8'), ('wedgesteps', 'f8')]
+
+
+def _header(dtype, n):
+    """ .npy version 1.0 header for n records of dtype, padded to HEADER_LEN """
+    d = "{'descr': %r, 'fortran_order': False, 'shape': (%i,), }" % (
+        np.lib.format.dtype_to_descr(dtype), n)
+    pad = HEADER_LEN - len(np.lib.format.MAGIC_PREFIX) - 4 - len(d) - 1
+    if pad < 0:
+        raise ValueError("record dtype too long for the log header")
+    header = d + ' ' * pad + '\n'
+    return np.lib.format.magic(1, 0) + np.array(len(header), '<u2').tobytes() + header.encode('latin1')
+
+
+def log_path(directory, day, prefix='CEPfastloop'):
+    """ file of the log of day, a 'YYYY-MM-DD' string """
+    return os.path.join(directory, '%s_%s.npy' % (prefix, day))
+
+
+class BinaryLogger(threading.Thread):
+    """ Background writer of records of dtype into daily segments in directory """
+
+    def __init__(self, directory, dtype, prefix='CEPfastloop', flush_interval=5.):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.directory = directory
+        self.dtype = np.dtype(dtype)
+        self.prefix = prefix
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._stop_event = threading.Event()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.start()
+
+    def log(self, records):
+        """ Queue one record or an array of them; never blocks on the disk """
+        self._queue.put(np.array(records, dtype=self.dtype, ndmin=1))
+
+    def stop(self, timeout=10.):
+        """ Write what is queued and end the thread """
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def run(self):
+        while not self._stop_event.wait(self.flush_interval):
+            self._flush()
+        self._flush()
+
+    def _flush(self):
+        """ write all queued records, split by day """
+        batches = []
+        while True:
+            try:
+                batches.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if not batches:
+            return
+        records = np.concatenate(batches)
+        days = np.array([time.strftime('%Y-%m-%d', time.localtime(t)) for t in records['time']])
+        for day in np.unique(days):
+            self._append(log_path(self.directory, day, self.prefix), records[days == day])
+
+    def _append(self, path, records):
+        """ append records to a segment and update its header """
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(_header(self.dtype, 0))
+        with open(path, 'r+b') as f:
+            # a crash during a write can leave part of a record at the end, cut it off
+            # so the records appended now stay aligned
+            n = (os.fstat(f.fileno()).st_size - HEADER_LEN) // self.dtype.itemsize
+            f.seek(HEADER_LEN + n * self.dtype.itemsize)
+            f.truncate()
+            f.write(records.tobytes())
+            n = (f.tell() - HEADER_LEN) // self.dtype.itemsize
+            f.seek(0)
+            f.write(_header(self.dtype, n))
+
+
+def read_log(directory, day, prefix='CEPfastloop'):
+    """ Memory-mapped records of one day's log, day a 'YYYY-MM-DD' string """
+    path = log_path(directory, day, prefix)
+    with open(path, 'rb') as f:
+        np.lib.format.read_magic(f)
+        dtype = np.lib.format.read_array_header_1_0(f)[2]
+        offset = f.tell()
+    n = (os.path.getsize(path) - offset) // dtype.itemsize
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(n,))
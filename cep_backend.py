@@ -0,0 +1,216 @@
+"""
+Hardware and simulated backends of CEPfastloop.
+
+A backend hands out the ADC source (anything with readADCDifferential, like the
+Adafruit ads1x15) and the serial port of the picomotor controller, and names the
+default log directory. The simulated one runs everything against a WedgePlant: the
+ADC reads the plant's AOM voltage and the serial port is one end of a pseudo
+terminal whose other end is served by PicomotorSimulator, which speaks the
+controller's commands and moves the plant's wedge. The plant runs on its own clock,
+SimClock(speed) for faster than real time in the GUI or ManualClock to step it from
+a benchmark:
+
+    backend = SimulatedBackend(WedgePlant(drift=0.5, clock=SimClock(speed=10)))
+    ex = CEPfastloop(backend)
+"""
+
+import os
+import time
+import tempfile
+import tty
+import threading
+import numpy as np
+
+
+class SimClock(object):
+    """ Wall time running speed times faster, starting at 0 """
+
+    def __init__(self, speed=1.):
+        self.speed = speed
+        self._t0 = time.time()
+
+    def __call__(self):
+        return (time.time() - self._t0) * self.speed
+
+
+class ManualClock(object):
+    """ Simulated time that only moves on advance """
+
+    def __init__(self, t=0.):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+    def advance(self, dt):
+        self.t += dt
+
+
+class WedgePlant(object):
+    """ AOM voltage (mV) of the oscillator as a function of the wedge position.
+
+    voltage = v0 + gain*position(t-latency) + drift*t + white noise of rms noise (mV),
+    the wedge moves at velocity steps/s towards its target. Times come from clock """
+
+    def __init__(self, v0=500., gain=0.5, drift=0.05, noise=5., latency=0.3,
+                 velocity=2000., clock=None, seed=None):
+        self.v0 = v0
+        self.gain = gain
+        self.drift = drift
+        self.noise = noise
+        self.latency = latency
+        self.velocity = velocity
+        self.clock = SimClock() if clock is None else clock
+        self._rng = np.random.RandomState(seed)
+        self._lock = threading.Lock()
+        # motion segments (start time, start position, target), the last one current
+        self._segments = [(self.clock(), 0., 0.)]
+
+    def position(self, t=None):
+        """ wedge position (steps) at time t (a scalar or an array), now by default """
+        t = self.clock() if t is None else t
+        with self._lock:
+            segments = np.array(self._segments)
+        i = np.maximum(np.searchsorted(segments[:, 0], t, 'right') - 1, 0)
+        t0, p0, target = segments[i].T
+        travel = np.maximum(t - t0, 0) * self.velocity
+        return p0 + np.sign(target - p0) * np.minimum(travel, abs(target - p0))
+
+    def moving(self):
+        """ True while the wedge has not reached its target """
+        t0, p0, target = self._segments[-1]
+        return self.position() != target
+
+    def move(self, steps):
+        """ start a relative move of steps from wherever the wedge is now """
+        t = self.clock()
+        p = self.position(t)
+        with self._lock:
+            target = self._segments[-1][2] + steps
+            self._segments.append((t, p, target))
+            # voltage looks latency into the past, older segments are not needed
+            while len(self._segments) > 1 and self._segments[1][0] < t - self.latency - 1:
+                self._segments.pop(0)
+
+    def voltage(self, t=None):
+        """ AOM voltage (mV) at time t (a scalar or an array), now by default """
+        t = self.clock() if t is None else t
+        return (self.v0 + self.gain * self.position(t - self.latency) + self.drift * t
+                + self.noise * self._rng.standard_normal(np.shape(t)))
+
+
+class SimulatedADC(object):
+    """ Stand-in for the ads1x15 reading the AOM voltage of a plant """
+
+    offset = 830.   # mV, the offset CEPfastloop adds to the differential reading
+
+    def __init__(self, plant):
+        self.plant = plant
+
+    def readADCDifferential(self, chP=0, chN=1, pga=6144, sps=3300):
+        time.sleep(1. / sps)
+        return self.plant.voltage() - self.offset
+
+
+class PicomotorSimulator(threading.Thread):
+    """ Serves the picomotor controller protocol on a pseudo terminal: port is the
+    device to open with pyserial. Understands REL, GO and MD? and echoes commands
+    until ECHO OFF; the setup commands are accepted and ignored """
+
+    def __init__(self, plant):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.plant = plant
+        self._master, slave = os.openpty()
+        tty.setraw(slave)
+        self._slave = slave
+        self.port = os.ttyname(slave)
+        self.echo = True
+        self._relative = 0
+        self._running = True
+        self.start()
+
+    def _reply(self, text):
+        os.write(self._master, (text + '\r\n').encode('ascii'))
+
+    def handle(self, command):
+        """ answer one command line """
+        if self.echo:
+            self._reply(command)
+        words = command.split()
+        if not words:
+            return
+        if command == 'ECHO OFF':
+            self.echo = False
+        elif command == 'ECHO ON':
+            self.echo = True
+        elif words[0] == 'REL' and len(words) == 3:
+            self._relative += int(words[2])
+        elif words[0] == 'GO':
+            self.plant.move(self._relative)
+            self._relative = 0
+        elif words[0] == 'MD?':
+            self._reply('0' if self.plant.moving() else '1')
+
+    def run(self):
+        pending = b''
+        while self._running:
+            try:
+                pending += os.read(self._master, 1024)
+            except OSError:
+                return
+            while b'\n' in pending or b'\r' in pending:
+                line, pending = pending.replace(b'\r\n', b'\n').replace(b'\r', b'\n').split(b'\n', 1)
+                self.handle(line.decode('ascii', 'replace').strip())
+
+    def close(self):
+        self._running = False
+        os.close(self._slave)
+        os.close(self._master)
+
+
+class HardwareBackend(object):
+    """ The ADS1015 on I2C and the picomotor controller on /dev/ttyUSB0 """
+
+    init_delay = 10.    # s the controller needs after INI
+    log_dir = '/home/pi/CEPfastloop_logs'
+
+    def __init__(self, port="/dev/ttyUSB0"):
+        self.port = port
+
+    def adc(self):
+        from adafruit_ads1x15 import ads1x15
+        return ads1x15(ic=0x00)
+
+    def serial_port(self):
+        import serial
+        return serial.Serial(self.port, baudrate=19200, timeout=3.0)
+
+    def close(self):
+        pass
+
+
+class SimulatedBackend(object):
+    """ A WedgePlant behind a simulated ADC and a pty picomotor controller """
+
+    init_delay = 0.
+    # simulated runs log locally, apart from the real logs
+    log_dir = os.path.join(tempfile.gettempdir(), 'CEPfastloop_simulation_logs')
+
+    def __init__(self, plant=None):
+        self.plant = WedgePlant() if plant is None else plant
+        self.controller = None
+
+    def adc(self):
+        return SimulatedADC(self.plant)
+
+    def serial_port(self):
+        import serial
+        if self.controller is None:
+            self.controller = PicomotorSimulator(self.plant)
+        return serial.Serial(self.controller.port, baudrate=19200, timeout=3.0)
+
+    def close(self):
+        if self.controller is not None:
+            self.controller.close()
+            self.controller = None
@@ -1,56 +1,201 @@
 from serial.tools.list_ports import comports
+from concurrent.futures import ThreadPoolExecutor
 import platform
-import usb
+import threading
+import time
 import os
-from .port import Port    
-def find_stages():
-    serial_ports = [(x[0], x[1], dict(y.split('=', 1) for y in x[2].split(' ') if '=' in y)) for x in comports()]
-    #print(serial_ports[0][2]['SER'])
-    # expected output is [('/dev/ttyUSB0', 'APT DC Motor Controller', {'VID:PID': '0403:FAF0', 'SER': '83844171', 'LOCATION': '1-1.1'}),
-    # ('/dev/ttyAMA0', 'ttyAMA0', {})]
-    # each identified serial port is expressed within a tuple, i.e. ('','','').
-    # The loop will find all matched devices and store them in a list called dev
-    dev = []
-    for dev_ini in usb.core.find(find_all=True, custom_match= lambda x: x.bDeviceClass != 9):
-        dev.append(dev_ini)
-    # Since we know the controller will be the second device to show up, therefore we and predict that 
-    # dev[1] is the device we're looking for
+import weakref
+from .port import Port
+try:
+    # optional, lets a hotplug event invalidate the port cache at once
+    import pyudev
+except ImportError:
+    pyudev = None
+
+# USB VID:PID of the supported controllers, the KDC101 shows up as an FTDI serial converter
+CONTROLLER_IDS = ('0403:FAF0',)
+# s after which the serial number -> port mapping is enumerated again, without pyudev
+CACHE_TTL = 60.
+
+_cache = {'ports': None, 'time': 0.}
+_cache_lock = threading.Lock()
+_observer = None
+
+
+def list_controllers():
+    """ {serial number: serial port} of the connected controllers, from comports alone """
+    # comports gives e.g. ('/dev/ttyUSB0', 'APT DC Motor Controller',
+    # 'USB VID:PID=0403:FAF0 SER=83844171 LOCATION=1-1.1')
+    ports = {}
+    for x in comports():
+        info = dict(y.split('=', 1) for y in x[2].split(' ') if '=' in y)
+        if info.get('VID:PID', '').upper() in CONTROLLER_IDS and 'SER' in info:
+            ports[info['SER']] = x[0]
+    return ports
+
+
+def invalidate_cache(device=None):
+    """ Forget the cached port mapping, the next lookup enumerates again """
+    with _cache_lock:
+        _cache['ports'] = None
+
+
+def _watch_hotplug():
+    """ invalidate the cache on every tty hotplug event, if pyudev is there """
+    global _observer
+    if pyudev is None or _observer is not None:
+        return
     try:
-        #FIXME: this avoids an error related to https://github.com/walac/pyusb/issues/139
-        #FIXME: this could maybe be solved in a better way?
-        dev[1]._langids = (1033, )
-        # KDC101 3-port is recognized as FTDI in newer kernels
-        if not (dev[1].manufacturer == 'Thorlabs' or dev[1].manufacturer == 'FTDI'):
-            raise Exception('No manufacturer found')
-    except usb.core.USBError:
-        print("No stage controller found: make sure your device is connected")
-        break
-        
-    if platform.system() == 'Linux':
-        # this is to check if the operating system is Linux, if not the code won't work. N.B. codename of MacOS
-        # is Darwin.
-        port_candidates = [x[0] for x in serial_ports if x[2].get('SER', None) == dev[1].serial_number]
-        # expected value for port_candidates is:
-        # ['/dev/ttyUSB0'], which is the serial port to communicate with the controller through
-        
-    else:
+        monitor = pyudev.Monitor.from_netlink(pyudev.Context())
+        monitor.filter_by('tty')
+        _observer = pyudev.MonitorObserver(monitor, callback=invalidate_cache)
+        _observer.daemon = True
+        _observer.start()
+    except Exception as e:
+        print("no hotplug monitoring, falling back to a %g s port cache: %s" % (CACHE_TTL, e))
+        _observer = False
+
+
+def controller_ports(refresh=False):
+    """ {serial number: serial port} of the connected controllers, cached. The cache
+    is dropped on hotplug events (with pyudev) or after CACHE_TTL s, and whenever a
+    cached port disappeared """
+    _watch_hotplug()
+    with _cache_lock:
+        ports = _cache['ports']
+        expired = not _observer and time.time() - _cache['time'] > CACHE_TTL
+        if refresh or ports is None or expired or not all(os.path.exists(p) for p in ports.values()):
+            ports = list_controllers()
+            _cache['ports'] = ports
+            _cache['time'] = time.time()
+        return dict(ports)
+
+
+class ConnectionPool(object):
+    """ The open controller Ports of the process, one per serial number, shared by all
+    find_stages calls instead of reopening the serial port each time. Each Port has a
+    lock that serialises the moves of its stages """
+
+    def __init__(self):
+        self._ports = {}    # serial number: (device, Port)
+        self._port_locks = {}   # Port: lock
+        self._stage_ports = weakref.WeakKeyDictionary()    # stage: Port
+        self._lock = threading.Lock()
+
+    def register(self, stage, port):
+        """ Remember the Port a stage of find_stages talks through """
+        with self._lock:
+            self._stage_ports[stage] = port
+
+    def port_lock(self, stage):
+        """ The lock of the Port of a stage; stages not from find_stages share one """
+        with self._lock:
+            return self._port_locks.setdefault(self._stage_ports.get(stage), threading.Lock())
+
+    def _drop(self, serial_number):
+        """ forget a Port, returns it for closing outside the lock """
+        device, port = self._ports.pop(serial_number, (None, None))
+        self._port_locks.pop(port, None)
+        return port
+
+    def ports(self, serial_numbers=None, refresh=False):
+        """ {serial number: Port} of the connected controllers, or of those with the
+        given serial numbers; the ones not open yet are opened concurrently. A Port
+        whose controller went away or moved to another device is closed and dropped """
+        connected = controller_ports(refresh)
+        devices = connected
+        if serial_numbers is not None:
+            missing = [s for s in serial_numbers if s not in devices]
+            if missing:
+                print("Stage controllers not found: %s" % ', '.join(missing))
+            devices = dict((s, devices[s]) for s in serial_numbers if s in devices)
+        stale = []
+        with self._lock:
+            for sn, (device, port) in list(self._ports.items()):
+                if connected.get(sn) != device:
+                    stale.append(self._drop(sn))
+            new = sorted((sn, device) for sn, device in devices.items() if sn not in self._ports)
+        # opening takes a while, moves on the open Ports go on meanwhile
+        created = list(executor().map(lambda item: Port.create(item[1], item[0]), new))
+        with self._lock:
+            for (sn, device), port in zip(new, created):
+                if sn in self._ports:
+                    # another call opened it first
+                    stale.append(port)
+                else:
+                    self._ports[sn] = (device, port)
+            ports = dict((sn, self._ports[sn][1]) for sn in devices if sn in self._ports)
+        for port in stale:
+            _close(port)
+        return ports
+
+    def discard(self, serial_number):
+        """ Drop and close the Port of a controller, e.g. after a communication error """
+        with self._lock:
+            port = self._drop(serial_number)
+        if port is not None:
+            _close(port)
+
+
+def _close(port):
+    """ close a dropped Port, its device may be gone already """
+    try:
+        port.close()
+    except Exception as e:
+        print("closing the port of a dropped controller failed: %s" % e)
+
+
+pool = ConnectionPool()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    """ The thread pool the controllers are opened and driven on """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=16)
+        return _executor
+
+
+def find_stages(serial_numbers=None, refresh=False):
+    """ Yield the stages of all connected controllers, or of those with the given
+    serial numbers. Controllers not opened before are opened concurrently """
+    if platform.system() != 'Linux':
+        # N.B. codename of MacOS is Darwin.
         raise NotImplementedError("Your operating system is not supported. " \
             "PyStage_APT only works on Linux.")
-        
-    # we make sure at each iteration only one port entry is contained in port candidates
-    # i.e. the ports are accessed one by one NOT all at one go.
-    assert len(port_candidates) == 1
-    port = port_candidates[0]
-    p = Port.create(port, dev[1].serial_number)
-    for stage in p.get_stages().values():
-        # generator type
-        yield stage
-        
-        
-        
-        
-            
-        
+    ports = pool.ports(serial_numbers, refresh)
+    if not ports:
+        print("No stage controller found: make sure your device is connected")
+        return
+    for sn in sorted(ports):
+        for stage in ports[sn].get_stages().values():
+            pool.register(stage, ports[sn])
+            # generator type
+            yield stage
+
+
+def move_stages(targets, relative=False, wait=True, timeout=None):
+    """ Move several stages at once, targets a dict of stage: position (or distance
+    with relative). Each move runs blocking on its own thread and holds the lock of
+    its stage's Port, so stages on different controllers move at once while the
+    channels of one controller take turns. With wait, returns once all stopped and
+    raises the first error; otherwise returns {stage: Future} """
+    def move(stage, value):
+        with pool.port_lock(stage):
+            if relative:
+                return stage.move_by(value, blocking=True)
+            return stage.move_to(value, blocking=True)
+    futures = dict((stage, executor().submit(move, stage, value)) for stage, value in targets.items())
+    if not wait:
+        return futures
+    deadline = None if timeout is None else time.time() + timeout
+    for stage, future in futures.items():
+        future.result(None if deadline is None else max(deadline - time.time(), 0))
+
+
 if __name__ == '__main__':
     print(list(find_stages()))
 
@@ -0,0 +1,203 @@
+"""
+Persistent cache of cylinder ferromagnet field maps.
+
+A map is the field of a CylinderMagnet on one of the grids of field_plot. It is
+stored under a hash of (m, a, h, theta, grid spec, code version), so any change to
+the magnet, the grid, the solver or the grid builders makes a new entry. The code
+version combines h_field_strength.solver_version with a hash of the field_plot
+source. Repeated analyses load the map instead of recomputing it:
+
+    cache = FieldCache('field_maps', budget=2**30)
+    Hx, Hy, Hz = cache.field(CylinderMagnet(1, 1, 1, np.pi/4), 'spherical', rho=20,
+                             theta=np.linspace(0, np.pi, 10), phi=np.linspace(0, 2*np.pi, 10),
+                             center=(1, 1, 1))
+
+Each entry is one file: a JSON header followed by the (3, n) field in chunks of
+chunk_size points, each byte-shuffled and zlib-compressed. Maps are computed one
+chunk at a time. On loading, the file is memory-mapped and a chunk is only
+decompressed when a FieldMap read needs it. When storing an entry takes the cache
+over budget bytes, the least recently used entries (by file modification time,
+bumped on every load) are deleted.
+"""
+
+import os
+import json
+import zlib
+import struct
+import hashlib
+import numpy as np
+import h_field_strength
+import field_plot
+from field_plot import cartesian_grid, spherical_grid, cylindrical_grid
+
+GRIDS = {'cartesian': cartesian_grid, 'spherical': spherical_grid,
+         'cylindrical': cylindrical_grid}
+SUFFIX = '.fmap'
+
+
+def code_version():
+    """ Hash of the solver and grid sources, line endings normalised """
+    digest = hashlib.sha1(h_field_strength.solver_version().encode('ascii'))
+    path = os.path.splitext(field_plot.__file__)[0] + '.py'
+    with open(path, 'rb') as f:
+        digest.update(f.read().replace(b'\r\n', b'\n'))
+    return digest.hexdigest()[:16]
+
+
+def _spec_key(value):
+    """ JSON-able form of a grid parameter, arrays by their bytes """
+    if np.ndim(value) == 0:
+        return float(value)
+    value = np.ascontiguousarray(value, dtype=float)
+    return [list(value.shape), hashlib.sha1(value.tobytes()).hexdigest()]
+
+
+def cache_key(magnet, grid, spec, dtype=np.float64):
+    """ Hex digest naming the map of magnet on grid with parameters spec """
+    key = {'m': float(magnet.m), 'a': float(magnet.a), 'h': float(magnet.h),
+           'theta': float(magnet.theta), 'grid': grid, 'dtype': np.dtype(dtype).str,
+           'spec': dict((k, _spec_key(v)) for k, v in spec.items()),
+           'version': code_version()}
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode('ascii')).hexdigest()
+
+
+def _shuffle(a):
+    """ bytes of a grouped by significance, which compresses floats far better """
+    return a.view(np.uint8).reshape(-1, a.dtype.itemsize).T.tobytes()
+
+
+def _unshuffle(data, dtype):
+    dtype = np.dtype(dtype)
+    return np.frombuffer(data, np.uint8).reshape(dtype.itemsize, -1).T.copy().view(dtype).ravel()
+
+
+class FieldMap(object):
+    """ A stored field map, (3, n) values of dtype in chunks decompressed on access.
+    Index it like the array (map[0], map[:, 1000:2000]) or take np.asarray(map) """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            n = struct.unpack('<Q', f.read(8))[0]
+            self.header = json.loads(f.read(n).decode('ascii'))
+        self.path = path
+        self.dtype = np.dtype(self.header['dtype'])
+        self.shape = (3, self.header['n'])
+        self.chunk_size = self.header['chunk_size']
+        self._offsets = np.array(self.header['offsets']) + 8 + n
+        self._data = np.memmap(path, dtype=np.uint8, mode='r')
+        self._chunk = (None, None)  # the last decompressed chunk
+
+    def __len__(self):
+        return 3
+
+    def __iter__(self):
+        # Hx, Hy, Hz = map decompresses every chunk once
+        return iter(np.asarray(self))
+
+    def chunk(self, i):
+        """ The (3, chunk_size) values of chunk i (fewer in the last one) """
+        if self._chunk[0] != i:
+            data = zlib.decompress(self._data[self._offsets[i]:self._offsets[i+1]].tobytes())
+            self._chunk = (i, _unshuffle(data, self.dtype).reshape(3, -1))
+        return self._chunk[1]
+
+    def read(self, start=0, stop=None):
+        """ The (3, stop-start) values of points start to stop """
+        stop = self.shape[1] if stop is None else min(stop, self.shape[1])
+        out = np.empty((3, max(stop - start, 0)), dtype=self.dtype)
+        for i in range(start // self.chunk_size, (stop - 1) // self.chunk_size + 1 if stop > start else 0):
+            lo = max(start, i * self.chunk_size)
+            hi = min(stop, (i + 1) * self.chunk_size)
+            out[:, lo - start:hi - start] = self.chunk(i)[:, lo - i * self.chunk_size:hi - i * self.chunk_size]
+        return out
+
+    def __getitem__(self, index):
+        if not isinstance(index, tuple):
+            index = (index,)
+        points = index[1] if len(index) > 1 else slice(None)
+        if isinstance(points, slice) and points.step in (None, 1):
+            start, stop, _ = points.indices(self.shape[1])
+            return self.read(start, stop)[index[0]]
+        return np.asarray(self)[index]
+
+    def __array__(self, dtype=None, copy=None):
+        a = self.read()
+        return a if dtype is None else a.astype(dtype)
+
+
+class FieldCache(object):
+    """ Field maps stored in directory, at most budget bytes of them """
+
+    def __init__(self, directory='field_maps', budget=2**30, chunk_size=2**16, level=6):
+        self.directory = directory
+        self.budget = budget
+        self.chunk_size = chunk_size
+        self.level = level
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def get(self, magnet, grid, dtype=np.float64, **spec):
+        """ The stored FieldMap, None if there is none """
+        path = self.path(cache_key(magnet, grid, spec, dtype))
+        try:
+            fieldmap = FieldMap(path)
+        except (IOError, OSError):
+            return None
+        os.utime(path, None)    # most recently used
+        return fieldmap
+
+    def field(self, magnet, grid, dtype=np.float64, **spec):
+        """ The FieldMap of magnet on GRIDS[grid](**spec), computed and stored on the
+        first call """
+        fieldmap = self.get(magnet, grid, dtype, **spec)
+        if fieldmap is None:
+            fieldmap = self.put(magnet, grid, dtype, **spec)
+        return fieldmap
+
+    def put(self, magnet, grid, dtype=np.float64, **spec):
+        """ Compute and store the map, replacing any stored one """
+        key = cache_key(magnet, grid, spec, dtype)
+        x, y, z = GRIDS[grid](**spec)
+        chunks = []
+        for start in range(0, len(x), self.chunk_size):
+            s = slice(start, start + self.chunk_size)
+            H = np.array(magnet.field(x[s], y[s], z[s], dtype=dtype), dtype=dtype)
+            chunks.append(zlib.compress(_shuffle(H.ravel()), self.level))
+        header = {'n': len(x), 'dtype': np.dtype(dtype).str, 'chunk_size': self.chunk_size,
+                  'offsets': np.concatenate([[0], np.cumsum([len(c) for c in chunks])]).tolist(),
+                  'magnet': repr(magnet), 'grid': grid, 'version': code_version()}
+        header = json.dumps(header).encode('ascii')
+        path = self.path(key)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(struct.pack('<Q', len(header)))
+            f.write(header)
+            for c in chunks:
+                f.write(c)
+        os.rename(tmp, path)
+        self.evict(keep=path)
+        return FieldMap(path)
+
+    def entries(self):
+        """ (modification time, size, path) of the stored maps, oldest first """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(SUFFIX):
+                path = os.path.join(self.directory, name)
+                st = os.stat(path)
+                entries.append((st.st_mtime, st.st_size, path))
+        return sorted(entries)
+
+    def evict(self, keep=None):
+        """ Delete least recently used maps until the cache fits the budget """
+        entries = self.entries()
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if total <= self.budget:
+                break
+            if path != keep:
+                os.remove(path)
+                total -= size
@@ -0,0 +1,201 @@
+"""
+The cylinder ferromagnet field together with its gradient, and the force and torque
+on point dipoles in it.
+
+The gradient comes out of the same pass as the field: the solver code of
+h_field_strength._rz_terms is run on dual numbers, arrays that carry their
+derivatives along r and z. The derivatives of the elliptic integrals are closed
+forms in the complete and incomplete integrals of the same arguments, so each of the
+sixteen integrals is still evaluated once per point; the azimuth enters through
+cos(phi) and sin(phi) and is differentiated the same way.
+
+    H, G = field_gradient(x, y, z, CylinderMagnet(theta=np.pi/4))
+    F, torque = dipole_force_torque(mu, H, G)
+
+G[i, j] is dH_i/dx_j.
+"""
+
+import numpy as np
+import scipy.special as spc
+from h_field_strength import default_magnet, _rz_terms, _cartesian
+
+_COMPARE = (np.less, np.less_equal, np.greater, np.greater_equal, np.equal, np.not_equal)
+
+
+def _value(u):
+    return u.val if isinstance(u, _Dual) else u
+
+
+def _grad(u):
+    return u.grad if isinstance(u, _Dual) else None
+
+
+def _chain(*terms):
+    """ sum of coefficient*gradient over the terms that have a gradient """
+    total = 0
+    for coef, grad in terms:
+        if grad is not None:
+            total = total+coef*grad
+    return total
+
+
+def _pick(cond, ga, gb):
+    """ gradient of a pointwise choice between two operands """
+    return np.where(cond, 0 if ga is None else ga, 0 if gb is None else gb)
+
+
+# derivative rules of the ufuncs used by the solver, from the output, the input
+# values and the input gradients (None for constants)
+_RULES = {
+    np.add: lambda out, v, g: _chain((1, g[0]), (1, g[1])),
+    np.subtract: lambda out, v, g: _chain((1, g[0]), (-1, g[1])),
+    np.multiply: lambda out, v, g: _chain((v[1], g[0]), (v[0], g[1])),
+    np.true_divide: lambda out, v, g: _chain((1/v[1], g[0]), (-out/v[1], g[1])),
+    np.power: lambda out, v, g: _chain((v[1]*v[0]**(v[1]-1), g[0])),
+    np.negative: lambda out, v, g: _chain((-1, g[0])),
+    np.absolute: lambda out, v, g: _chain((np.sign(v[0]), g[0])),
+    np.sqrt: lambda out, v, g: _chain((0.5/out, g[0])),
+    np.square: lambda out, v, g: _chain((2*v[0], g[0])),
+    np.arcsin: lambda out, v, g: _chain((1/np.sqrt(1-v[0]**2), g[0])),
+    np.hypot: lambda out, v, g: _chain((v[0]/out, g[0]), (v[1]/out, g[1])),
+    np.minimum: lambda out, v, g: _pick(v[0] <= v[1], g[0], g[1]),
+    np.maximum: lambda out, v, g: _pick(v[0] >= v[1], g[0], g[1]),
+}
+
+
+def _complete(m, memo):
+    """ K, E and their derivatives in the parameter m, shared by ellipk and ellipe """
+    key = ('complete', id(m))
+    if key not in memo:
+        K, E = spc.ellipk(m), spc.ellipe(m)
+        memo[key] = (m, (K, (E-(1-m)*K)/(2*m*(1-m))), (E, (E-K)/(2*m)))
+    return memo[key]
+
+
+def _incomplete(phi, m, memo):
+    """ F, E of amplitude phi and parameter m and their derivatives in (phi, m), shared
+    by ellipkinc and ellipeinc """
+    key = ('incomplete', id(phi), id(m))
+    if key not in memo:
+        F, E = spc.ellipkinc(phi, m), spc.ellipeinc(phi, m)
+        delta = np.sqrt(1-m*np.sin(phi)**2)
+        dF_m = (E-(1-m)*F)/(2*m*(1-m))-np.sin(2*phi)/(4*(1-m)*delta)
+        memo[key] = (phi, m, (F, 1/delta, dF_m), (E, delta, (E-F)/(2*m)))
+    return memo[key]
+
+
+class _Dual(object):
+    """ Values val with their derivatives grad[k] along a few directions. numpy ufuncs,
+    np.where and np.select work on them; memo is shared by all the numbers of one pass
+    and keeps the elliptic integrals of each argument """
+    __slots__ = ('val', 'grad', 'memo')
+
+    def __init__(self, val, grad, memo):
+        self.val = val
+        self.grad = grad
+        self.memo = memo
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        if method != '__call__' or kwargs:
+            return NotImplemented
+        v = [_value(u) for u in inputs]
+        g = [_grad(u) for u in inputs]
+        if ufunc in _COMPARE:
+            return ufunc(*v)
+        if ufunc is spc.ellipk or ufunc is spc.ellipe:
+            KE = _complete(v[0], self.memo)[1 if ufunc is spc.ellipk else 2]
+            return _Dual(KE[0], _chain((KE[1], g[0])), self.memo)
+        if ufunc is spc.ellipkinc or ufunc is spc.ellipeinc:
+            FE = _incomplete(v[0], v[1], self.memo)[2 if ufunc is spc.ellipkinc else 3]
+            return _Dual(FE[0], _chain((FE[1], g[0]), (FE[2], g[1])), self.memo)
+        if ufunc not in _RULES or (ufunc is np.power and g[1] is not None):
+            return NotImplemented
+        out = ufunc(*v)
+        return _Dual(out, _RULES[ufunc](out, v, g), self.memo)
+
+    def __array_function__(self, func, types, args, kwargs):
+        if func is np.where:
+            cond, u, w = args
+            return _Dual(np.where(cond, _value(u), _value(w)),
+                         _pick(cond, _grad(u), _grad(w)), self.memo)
+        if func is np.select:
+            condlist, choicelist = args[:2]
+            out = args[2] if len(args) > 2 else kwargs.get('default', 0)
+            for cond, choice in reversed(list(zip(condlist, choicelist))):
+                out = np.where(cond, choice, out)
+            return out
+        return NotImplemented
+
+    def __add__(self, other): return np.add(self, other)
+    def __radd__(self, other): return np.add(other, self)
+    def __sub__(self, other): return np.subtract(self, other)
+    def __rsub__(self, other): return np.subtract(other, self)
+    def __mul__(self, other): return np.multiply(self, other)
+    def __rmul__(self, other): return np.multiply(other, self)
+    def __truediv__(self, other): return np.true_divide(self, other)
+    def __rtruediv__(self, other): return np.true_divide(other, self)
+    def __pow__(self, other): return np.power(self, other)
+    def __neg__(self): return np.negative(self)
+    def __abs__(self): return np.absolute(self)
+    def __lt__(self, other): return np.less(self, other)
+    def __le__(self, other): return np.less_equal(self, other)
+    def __gt__(self, other): return np.greater(self, other)
+    def __ge__(self, other): return np.greater_equal(self, other)
+
+
+def _seed(values, k, n, memo):
+    """ dual number of values that is the k-th of n independent variables """
+    grad = np.zeros((n,)+values.shape)
+    grad[k] = 1
+    return _Dual(values, grad, memo)
+
+
+def field_gradient(x, y, z, magnet=None):
+    """ The field H (3, ...) at the points x, y, z and its gradient G (3, 3, ...),
+    G[i, j] = dH_i/dx_j, from one evaluation of the elliptic integrals. magnet is a
+    CylinderMagnet and defaults to the module parameters of h_field_strength.
+
+    The gradient is nan on the axis, where the solver switches to the closed-form axial
+    field, and is not finite on the faces and the rim, where the field steps or
+    diverges """
+    if magnet is None:
+        magnet = default_magnet()
+    x, y, z = np.broadcast_arrays(np.asarray(x, dtype=float),
+                                  np.asarray(y, dtype=float),
+                                  np.asarray(z, dtype=float))
+    shape = x.shape
+    x, y, z = x.ravel(), y.ravel(), z.ravel()
+    a = np.full(x.shape, float(magnet.a))
+    h = np.full(x.shape, float(magnet.h))
+    memo = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        X, Y, Z = (_seed(c, k, 3, memo) for k, c in enumerate((x, y, z)))
+        R = np.hypot(X, Y)
+        axis = R.val == 0
+        R = np.where(axis, 0.5*a, R)
+        #the profiles only need d/dr and d/dz, go to x, y, z afterwards
+        rz = _rz_terms(_seed(R.val, 0, 2, memo), _seed(z, 1, 2, memo), a, h)
+        rz = [_Dual(p.val, p.grad[0]*R.grad+p.grad[1]*Z.grad, memo) for p in rz]
+        cos_phi = np.where(axis, 1., X/R)
+        sin_phi = np.where(axis, 0., abs(Y)/R)
+        fields = _cartesian(cos_phi, sin_phi, *rz)
+        c = magnet.m*np.cos(magnet.theta)
+        s = magnet.m*np.sin(magnet.theta)
+        H = [fields[i]*c+fields[i+3]*s for i in range(3)]
+    G = np.array([Hi.grad for Hi in H])
+    H = np.array([Hi.val for Hi in H])
+    if np.any(axis):
+        H[:, axis] = magnet.field(x[axis], y[axis], z[axis])
+        G[:, :, axis] = np.nan
+    return H.reshape((3,)+shape), G.reshape((3, 3)+shape)
+
+
+def dipole_force_torque(mu, H, G):
+    """ Force F_j = sum_i mu_i dH_i/dx_j and torque mu x H on point dipoles of moment
+    mu (3, ...) in the field H (3, ...) with gradient G (3, 3, ...) of field_gradient,
+    outside the magnet where curl H = 0 """
+    mu = np.asarray(mu, dtype=float)
+    mu = mu.reshape(mu.shape+(1,)*(H.ndim-mu.ndim))
+    F = np.einsum('i...,ij...->j...', mu, G)
+    torque = np.cross(mu, H, axis=0)
+    return F, torque
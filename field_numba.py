@@ -0,0 +1,226 @@
+"""
+Compiled per-point kernel of the cylinder ferromagnet field.
+
+With numba installed the solver of h_field_strength is compiled into a parallel
+generalised ufunc that evaluates (Hx, Hy, Hz) point by point in one pass, without the
+full-size temporaries of the numpy version, and only evaluates the inside or the
+outside expressions a point needs. The elliptic integrals are Carlson's symmetric
+forms, since numba cannot call scipy.special. Without numba, or for dtypes other than
+float64, the functions fall back to the numpy solver:
+
+    from field_numba import H_spherical_ferromag   # same call as h_field_strength
+    Hx, Hy, Hz = H_spherical_ferromag(x, y, z)
+"""
+
+import math
+import numpy as np
+from h_field_strength import default_magnet
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+HAVE_NUMBA = numba is not None
+
+if HAVE_NUMBA:
+    #IEEE division, 0/0 gives nan at the rim like the numpy solver
+    _jit = numba.njit(cache=True, error_model='numpy')
+else:
+    def _jit(func):
+        return func
+
+
+@_jit
+def _rf(x, y, z):
+    """ Carlson's R_F(x, y, z) by duplication """
+    if x+y == 0 or y+z == 0 or z+x == 0:
+        return math.inf
+    while True:
+        mu = (x+y+z)/3
+        dx, dy, dz = (mu-x)/mu, (mu-y)/mu, (mu-z)/mu
+        if not max(abs(dx), abs(dy), abs(dz)) > 1e-3:
+            break
+        sx, sy, sz = math.sqrt(x), math.sqrt(y), math.sqrt(z)
+        lam = sx*(sy+sz)+sy*sz
+        x, y, z = 0.25*(x+lam), 0.25*(y+lam), 0.25*(z+lam)
+    e2 = dx*dy-dz*dz
+    e3 = dx*dy*dz
+    return (1+(e2/24-0.1-3*e3/44)*e2+e3/14)/math.sqrt(mu)
+
+
+@_jit
+def _rd(x, y, z):
+    """ Carlson's R_D(x, y, z) by duplication """
+    if x+y == 0 or z == 0:
+        return math.inf
+    total = 0.
+    fac = 1.
+    while True:
+        sx, sy, sz = math.sqrt(x), math.sqrt(y), math.sqrt(z)
+        lam = sx*(sy+sz)+sy*sz
+        total += fac/(sz*(z+lam))
+        fac *= 0.25
+        x, y, z = 0.25*(x+lam), 0.25*(y+lam), 0.25*(z+lam)
+        mu = 0.2*(x+y+3*z)
+        dx, dy, dz = (mu-x)/mu, (mu-y)/mu, (mu-z)/mu
+        if not max(abs(dx), abs(dy), abs(dz)) > 1e-3:
+            break
+    ea = dx*dy
+    eb = dz*dz
+    ec = ea-eb
+    ed = ea-6*eb
+    ee = ed+ec+ec
+    return 3*total+fac*(1+ed*(-3./14+9./88*ed-9./52*dz*ee)
+                        +dz*(ee/6+dz*(-9./22*ec+dz*3./26*ea)))/(mu*math.sqrt(mu))
+
+
+@_jit
+def _ellipke(m):
+    """ K(m) and E(m) of parameter m, as scipy.special.ellipk and ellipe """
+    if m == 1:
+        return math.inf, 1.
+    rf = _rf(0., 1-m, 1.)
+    return rf, rf-m/3*_rd(0., 1-m, 1.)
+
+
+@_jit
+def _ellipkeinc(phi, m):
+    """ F(phi|m) and E(phi|m) for 0 <= phi <= pi/2, as scipy.special.ellipkinc and
+    ellipeinc """
+    s = math.sin(phi)
+    c = math.cos(phi)
+    rf = s*_rf(c*c, 1-m*s*s, 1.)
+    if m == 1:
+        return rf, s
+    return rf, rf-m/3*s*s*s*_rd(c*c, 1-m*s*s, 1.)
+
+
+@_jit
+def _lam(K, E, F, Ei):
+    return E*F+K*(Ei-F)
+
+
+@_jit
+def _alp_bta(r, z, a):
+    """ h_field_strength._alp_bta at one point """
+    sqrt1 = math.sqrt(((a-r)**2+z**2)*((a+r)**2+z**2))
+    Q = a*a+r*r+z*z
+    alp = (4*a*a*r*r)/(Q+sqrt1)**2
+    D = a*a-r*r
+    if D > 0:
+        sqrt1_D = z*z*(2*(a*a+r*r)+z*z)/(sqrt1+D)
+    else:
+        sqrt1_D = sqrt1-D
+    bta = math.asin(math.sqrt(min((sqrt1_D+z*z)/(2*sqrt1), 1.)))
+    return alp, bta
+
+
+@_jit
+def _rz_terms(r, z, a, h):
+    """ h_field_strength._rz_terms at one point off the axis """
+    inside = z < 0 and z >= -h
+    sign_z = 1. if z >= 0 else -1.
+    sign_zp = 1. if z >= -h else -1.
+    z_p = z+h
+    alp, bta1 = _alp_bta(r, z, a)
+    alp_p, bta2 = _alp_bta(r, z_p, a)
+    alp1 = math.sqrt(alp)
+    alp2 = math.sqrt(alp_p)
+    k1 = math.sqrt((4*a*r)/(z**2+(a+r)**2))
+    k2 = math.sqrt((4*a*r)/(z_p**2+(a+r)**2))
+    bta1_p = math.asin(abs(z)/math.sqrt(z**2+(a-r)**2))
+    bta1_pp = math.asin(abs(z_p)/math.sqrt(z_p**2+(a-r)**2))
+    q1, q2 = math.sqrt(1-alp), math.sqrt(1-alp_p)
+    kp1, kp2 = math.sqrt(1-k1**2), math.sqrt(1-k2**2)
+
+    #the K and E of one argument share their R_F
+    Ka1, Ea1 = _ellipke(alp1)
+    Ka2, Ea2 = _ellipke(alp2)
+    Kk1, Ek1 = _ellipke(k1)
+    Kk2, Ek2 = _ellipke(k2)
+    Fb1, Eb1 = _ellipkeinc(bta1, q1)
+    Fb2, Eb2 = _ellipkeinc(bta2, q2)
+    Fp1, Ep1 = _ellipkeinc(bta1_p, kp1)
+    Fp2, Ep2 = _ellipkeinc(bta1_pp, kp2)
+
+    lam1 = _lam(Ka1, Ea1, Fb1, Eb1)
+    lam2 = _lam(Ka2, Ea2, Fb2, Eb2)
+    u_z = 1-(2/np.pi)*lam1
+    u_zp = 1-(2/np.pi)*lam2
+    min_max = min(a, r)/(2*max(a, r))
+    ar = a*r
+    w_z = abs(z)*Ek1/(np.pi*k1*math.sqrt(ar)) \
+          -(abs(z)*k1*(a**2+r**2+0.5*z**2)*Kk1)/(2*np.pi*(ar**1.5)) \
+          +(abs(a**2-r**2)/(2*np.pi*ar))*_lam(Kk1, Ek1, Fp1, Ep1) \
+          +min_max
+    #the w_zp lambda term takes K(k1) with E(k2), as in h_field_strength
+    w_zp = abs(z_p)*Ek2/(np.pi*k2*math.sqrt(ar)) \
+          -(abs(z_p)*k2*(a**2+r**2+0.5*z_p**2)*Kk2)/(2*np.pi*(ar**1.5)) \
+          +(abs(a**2-r**2)/(2*np.pi*ar))*_lam(Kk1, Ek2, Fp2, Ep2) \
+          +min_max
+
+    H_zz = -4*(sign_z*lam1-sign_zp*lam2)
+    H_zr = 4*math.sqrt(a/r)*((1/k1)*((1-0.5*k1**2)*Kk1-Ek1) \
+           -(1/k2)*((1-0.5*k2**2)*Kk2-Ek2))
+    if inside:
+        if a < r:
+            part = 2*np.pi*(a/r)**2
+        elif a == r:
+            part = 0.
+        else:
+            part = -2*np.pi
+        H_zz -= 4*np.pi
+        H_xr = 2*np.pi*a*(((u_z+u_zp)/a)-((w_z+w_zp)/r))+part
+        H_xphi = (2*np.pi*a/r)*(min(a, r)/max(a, r))-(2*np.pi*a/r)*(w_z+w_zp)
+    else:
+        H_xr = -2*np.pi*a*(((sign_z*u_z-sign_zp*u_zp)/a)+((sign_z*w_z-sign_zp*w_zp)/r))
+        H_xphi = 2*np.pi*a*((sign_z*w_z-sign_zp*w_zp)/r)
+    return H_zr, H_zz, H_xr, H_xphi
+
+
+@_jit
+def _point(x, y, z, a, h, c, s):
+    """ (Hx, Hy, Hz) at one point for axial and in-plane magnetisations c and s """
+    r = math.hypot(x, y)
+    if r == 0:
+        z_p = z+h
+        on_axis = np.pi*(z/math.sqrt(a**2+z**2)-z_p/math.sqrt(a**2+z_p**2))
+        H_zz = -2*on_axis
+        if z < 0 and z >= -h:
+            H_zz -= 4*np.pi
+        return s*on_axis, 0., c*H_zz
+    cos_phi = x/r
+    sin_phi = abs(y)/r
+    H_zr, H_zz, H_xr, H_xphi = _rz_terms(r, z, a, h)
+    H_xx = H_xr*cos_phi**2-H_xphi*sin_phi**2
+    H_xy = (H_xr+H_xphi)*sin_phi*cos_phi
+    return (c*H_zr*cos_phi+s*H_xx, c*H_zr*sin_phi+s*H_xy,
+            c*H_zz+s*H_zr*cos_phi)
+
+
+if HAVE_NUMBA:
+    @numba.guvectorize(['void(float64, float64, float64, float64, float64, float64, '
+                        'float64, float64[:], float64[:], float64[:])'],
+                       '(),(),(),(),(),(),()->(),(),()', target='parallel', cache=True)
+    def _field_ufunc(x, y, z, a, h, c, s, Hx, Hy, Hz):
+        Hx[0], Hy[0], Hz[0] = _point(x, y, z, a, h, c, s)
+
+
+def field(magnet, x, y, z, out=None, dtype=np.float64):
+    """ CylinderMagnet.field of magnet on the compiled kernel, parallel over the cores.
+    Falls back to magnet.field without numba or for dtypes other than float64 """
+    if not HAVE_NUMBA or np.dtype(dtype) != np.float64:
+        return magnet.field(x, y, z, out=out, dtype=dtype)
+    c = magnet.m*np.cos(magnet.theta)
+    s = magnet.m*np.sin(magnet.theta)
+    x, y, z = (np.asarray(v, dtype=float) for v in (x, y, z))
+    if out is None:
+        return _field_ufunc(x, y, z, float(magnet.a), float(magnet.h), c, s)
+    return _field_ufunc(x, y, z, float(magnet.a), float(magnet.h), c, s, *out)
+
+
+def H_spherical_ferromag(x, y, z, out=None, dtype=np.float64):
+    """ h_field_strength.H_spherical_ferromag on the compiled kernel """
+    magnet = default_magnet()
+    return field(magnet, x, y, z, out=out, dtype=dtype)
@@ -0,0 +1,67 @@
+"""
+Chunked, multiprocess evaluation of the cylinder ferromagnet field for big point clouds.
+
+The points are cut into chunks of chunk_size and handed to a pool of forked workers.
+The workers read the coordinates inherited from the parent and write their chunk of
+(Hx, Hy, Hz) straight into an anonymous shared memory map, so apart from the inputs
+and outputs only a few chunks worth of solver temporaries are alive at any time.
+
+    Hx, Hy, Hz = field_parallel(x, y, z, chunk_size=2**14, workers=4)
+"""
+
+import mmap
+import multiprocessing
+import numpy as np
+from h_field_strength import default_magnet
+
+_job = {}
+
+
+def _init_worker(x, y, z, out, magnet):
+    """ keep the inherited arrays of the job in the worker """
+    _job.update(x=x, y=y, z=z, out=out, magnet=magnet)
+
+
+def _evaluate(bounds):
+    """ write the field of the points [i0:i1] into the shared output """
+    i0, i1 = bounds
+    x, y, z, out = _job['x'], _job['y'], _job['z'], _job['out']
+    _job['magnet'].field(x[i0:i1], y[i0:i1], z[i0:i1], out=out[:, i0:i1], dtype=out.dtype)
+    return i1-i0
+
+
+def field_parallel(x, y, z, chunk_size=2**14, workers=None, magnet=None,
+                   dtype=np.float64):
+    """ (Hx, Hy, Hz) at the points x, y, z, computed chunk by chunk on workers processes
+    (all cores by default). magnet is a CylinderMagnet and defaults to the module
+    parameters of h_field_strength, like H_spherical_ferromag. workers=1 runs the
+    chunks in this process. dtype is the precision of CylinderMagnet.field """
+    if magnet is None:
+        magnet = default_magnet()
+    x, y, z = np.broadcast_arrays(np.asarray(x, dtype=dtype),
+                                  np.asarray(y, dtype=dtype),
+                                  np.asarray(z, dtype=dtype))
+    shape = x.shape
+    x, y, z = x.ravel(), y.ravel(), z.ravel()
+    n = x.size
+    # anonymous maps are shared with forked children, the parent sees their writes
+    itemsize = np.dtype(dtype).itemsize
+    buf = mmap.mmap(-1, max(3*n*itemsize, 1))
+    out = np.frombuffer(buf, dtype=dtype, count=3*n).reshape(3, n)
+    chunks = [(i, min(i+chunk_size, n)) for i in range(0, n, chunk_size)]
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = min(workers, len(chunks))
+    if workers <= 1:
+        _init_worker(x, y, z, out, magnet)
+        try:
+            for bounds in chunks:
+                _evaluate(bounds)
+        finally:
+            _job.clear()
+    else:
+        ctx = multiprocessing.get_context('fork')
+        with ctx.Pool(workers, _init_worker, (x, y, z, out, magnet)) as pool:
+            for _ in pool.imap_unordered(_evaluate, chunks):
+                pass
+    return out[0].reshape(shape), out[1].reshape(shape), out[2].reshape(shape)
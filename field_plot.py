@@ -0,0 +1,68 @@
+"""
+Sampling grids and 3D quiver plots of the cylinder ferromagnet field.
+
+The grid builders return flat x, y, z arrays built by broadcasting, so they can go
+straight into the solver. field_quiver thins the points down to max_vectors before
+calling the solver once, so big grids cost only what is drawn:
+
+    x, y, z = spherical_grid(20, np.linspace(0, np.pi, 10), np.linspace(0, 2*np.pi, 10),
+                             center=(1, 1, 1))
+    field_quiver(x, y, z, CylinderMagnet(theta=np.pi/4))
+    plt.show()
+"""
+
+import numpy as np
+from h_field_strength import default_magnet
+
+
+def _flat_grid(*axes):
+    """ the flattened 'ij' mesh of the given 1D axes """
+    grids = np.meshgrid(*[np.atleast_1d(np.asarray(c, dtype=float)) for c in axes],
+                        indexing='ij')
+    return [g.ravel() for g in grids]
+
+
+def cartesian_grid(xs, ys, zs):
+    """ x, y, z of every combination of the xs, ys, zs """
+    return tuple(_flat_grid(xs, ys, zs))
+
+
+def spherical_grid(rho, theta, phi, center=(0, 0, 0)):
+    """ x, y, z of the points at radii rho, polar angles theta and azimuths phi around
+    center; the order is the one of nested loops over rho, theta, phi """
+    rho, theta, phi = _flat_grid(rho, theta, phi)
+    sin_theta = np.sin(theta)
+    return (rho*sin_theta*np.cos(phi)+center[0],
+            rho*sin_theta*np.sin(phi)+center[1],
+            rho*np.cos(theta)+center[2])
+
+
+def cylindrical_grid(r, phi, z, center=(0, 0, 0)):
+    """ x, y, z of the points at radii r, azimuths phi and heights z around center """
+    r, phi, z = _flat_grid(r, phi, z)
+    return r*np.cos(phi)+center[0], r*np.sin(phi)+center[1], z+center[2]
+
+
+def decimate(max_vectors, *arrays):
+    """ evenly spaced subset of at most max_vectors entries of each flat array """
+    n = arrays[0].size
+    if max_vectors is None or n <= max_vectors:
+        return arrays
+    keep = np.linspace(0, n-1, max_vectors).astype(int)
+    return tuple(c[keep] for c in arrays)
+
+
+def field_quiver(x, y, z, magnet=None, max_vectors=20000, ax=None, normalize=True, **kwargs):
+    """ Draw the field at the points x, y, z as a 3D quiver plot on ax (a new 3D axes
+    by default). At most max_vectors evenly spaced points are evaluated and drawn.
+    magnet defaults to the module parameters of h_field_strength. Extra keywords go
+    to ax.quiver. Returns the axes """
+    import matplotlib.pyplot as plt
+    if magnet is None:
+        magnet = default_magnet()
+    x, y, z = decimate(max_vectors, *(np.ravel(c) for c in (x, y, z)))
+    hx, hy, hz = magnet.field(x, y, z)
+    if ax is None:
+        ax = plt.figure(dpi=100).add_subplot(projection='3d')
+    ax.quiver(x, y, z, hx, hy, hz, normalize=normalize, **kwargs)
+    return ax
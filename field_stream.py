@@ -0,0 +1,123 @@
+"""
+Out-of-core evaluation of the cylinder ferromagnet field.
+
+Reads x, y, z from memory-mapped .npy files (or raw float64 files for any other
+extension) block by block, evaluates the field of each block with field_parallel and
+writes Hx, Hy, Hz into memory-mapped output files of the same kind. After every block
+the outputs are flushed and the number of finished points is written to a small
+progress file, so an interrupted run picks up at the last finished block. The file
+also records the job (magnet, input files with their size and modification time,
+output files); a run of a different job starts over:
+
+    python field_stream.py x.npy y.npy z.npy hx.npy hy.npy hz.npy
+"""
+
+import os
+import sys
+import json
+import numpy as np
+from field_parallel import field_parallel
+from h_field_strength import default_magnet
+
+
+def _open_input(path):
+    """ read-only memory map of a coordinate file """
+    if path.endswith('.npy'):
+        return np.load(path, mmap_mode='r')
+    return np.memmap(path, dtype=np.float64, mode='r')
+
+
+def _open_output(path, n, resume):
+    """ memory map of an output file of n float64 values, created unless resuming """
+    if path.endswith('.npy'):
+        if resume:
+            return np.load(path, mmap_mode='r+')
+        return np.lib.format.open_memmap(path, mode='w+', dtype=np.float64, shape=(n,))
+    return np.memmap(path, dtype=np.float64, mode='r+' if resume else 'w+', shape=(n,))
+
+
+def _outputs_match(paths, n):
+    """ True if the output files hold n float64 values each """
+    for path in paths:
+        if not os.path.exists(path):
+            return False
+        if path.endswith('.npy'):
+            try:
+                out = np.load(path, mmap_mode='r')
+            except (IOError, ValueError):
+                return False
+            if out.shape != (n,) or out.dtype != np.float64:
+                return False
+        elif os.path.getsize(path) != 8*n:
+            return False
+    return True
+
+
+def _job(in_paths, out_paths, magnet, n):
+    """ JSON-able identity of a run, what a progress file has to match to resume """
+    return {'n': n,
+            'magnet': [float(magnet.m), float(magnet.a), float(magnet.h), float(magnet.theta)],
+            'inputs': [[os.path.abspath(p), os.path.getsize(p), os.path.getmtime(p)]
+                       for p in in_paths],
+            'outputs': [os.path.abspath(p) for p in out_paths]}
+
+
+def _read_progress(path, job):
+    """ number of points already done by an interrupted run of the same job """
+    try:
+        with open(path) as f:
+            progress = json.load(f)
+    except (IOError, ValueError):
+        return 0
+    if progress.get('job') != job:
+        print("progress file %s belongs to another job, starting over" % path)
+        return 0
+    return progress['done']
+
+
+def _write_progress(path, job, done):
+    """ replace the progress file in one step, a crash leaves the old or the new one """
+    with open(path+'.tmp', 'w') as f:
+        json.dump({'job': job, 'done': done}, f)
+    os.replace(path+'.tmp', path)
+
+
+def field_stream(x_path, y_path, z_path, out_paths, block_size=2**20,
+                 magnet=None, workers=1, progress_path=None):
+    """ Write the field at the points of the x, y, z files into the three files of
+    out_paths, block_size points at a time. magnet and workers go to field_parallel.
+    The progress file defaults to the Hx path plus '.progress' and is removed when
+    the run completes. Returns the number of points """
+    if magnet is None:
+        magnet = default_magnet()
+    x, y, z = _open_input(x_path), _open_input(y_path), _open_input(z_path)
+    n = x.size
+    if y.size != n or z.size != n:
+        raise ValueError("coordinate files differ in length: %i, %i, %i" % (n, y.size, z.size))
+    if progress_path is None:
+        progress_path = out_paths[0]+'.progress'
+    job = _job((x_path, y_path, z_path), out_paths, magnet, n)
+    done = _read_progress(progress_path, job)
+    resume = done > 0 and _outputs_match(out_paths, n)
+    if not resume:
+        done = 0
+    out = [_open_output(p, n, resume) for p in out_paths]
+    while done < n:
+        stop = min(done+block_size, n)
+        H = field_parallel(x[done:stop], y[done:stop], z[done:stop],
+                           magnet=magnet, workers=workers)
+        for o, Hk in zip(out, H):
+            o[done:stop] = Hk
+            o.flush()
+        done = stop
+        _write_progress(progress_path, job, done)
+    if os.path.exists(progress_path):
+        os.remove(progress_path)
+    return n
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 7:
+        print("usage: python field_stream.py x y z hx hy hz")
+        sys.exit(1)
+    print("%i points done" % field_stream(*sys.argv[1:4], out_paths=sys.argv[4:7]))
@@ -0,0 +1,202 @@
+"""
+Lookup-table engine for the cylinder ferromagnet field of h_field_strength.
+
+The field only depends on the azimuth through cos(phi) and sin(phi), so the four
+profiles of h_field_strength._rz_profiles are tabulated once on an (r, z) grid and
+queries are answered by bilinear interpolation. The grid is split at the rim r=a and
+at the faces z=-h, z=0, where the profiles kink or step, into six patches whose nodes
+crowd towards those edges. Points outside the table, closer to the axis than r_min,
+or in a cell whose measured interpolation error is above target, are handed to the
+exact solver.
+
+    table = FieldTable.cached(a=1, h=1)
+    Hx, Hy, Hz = table.field(x, y, z, theta=np.pi/4)
+
+Tables are stored as a memory-mappable .npy (the profiles) next to a small .npz
+(nodes, parameters, the measured interpolation error and the cells left to the
+solver). The cache key of FieldTable.cached includes h_field_strength.solver_version,
+so a solver change builds a new table.
+"""
+
+import os
+import hashlib
+import numpy as np
+from h_field_strength import _polar, _rz_profiles, _assemble_basis, combine_basis, solver_version
+
+
+def _nodes(lo, hi, n, dense_lo=True, dense_hi=True):
+    """ n nodes on [lo, hi] crowding towards the dense ends """
+    t = np.linspace(0, 1, n)
+    if dense_lo and dense_hi:
+        s = 0.5*(1-np.cos(np.pi*t))
+    elif dense_lo:
+        s = 1-np.cos(0.5*np.pi*t)
+    elif dense_hi:
+        s = np.sin(0.5*np.pi*t)
+    else:
+        s = t
+    return lo+(hi-lo)*s
+
+
+def _cells(r_nodes, z_nodes, r, z):
+    """ indices (i, j) of the cells of one patch holding the points (r, z) """
+    i = np.clip(np.searchsorted(r_nodes, r)-1, 0, len(r_nodes)-2)
+    j = np.clip(np.searchsorted(z_nodes, z)-1, 0, len(z_nodes)-2)
+    return i, j
+
+
+def _interpolate(r_nodes, z_nodes, values, r, z, i, j):
+    """ bilinear interpolation of values (4, nr, nz) on one patch, in the cells i, j """
+    t = (r-r_nodes[i])/(r_nodes[i+1]-r_nodes[i])
+    u = (z-z_nodes[j])/(z_nodes[j+1]-z_nodes[j])
+    return (values[:, i, j]*((1-t)*(1-u))+values[:, i+1, j]*(t*(1-u))
+            +values[:, i, j+1]*((1-t)*u)+values[:, i+1, j+1]*(t*u))
+
+
+def _near_rim(r, z, a, h, rim):
+    """ True within rim*a of the edges of the two faces """
+    return np.minimum((r-a)**2+z**2, (r-a)**2+(z+h)**2) < (rim*a)**2
+
+
+class FieldTable(object):
+    """ Tabulated field profiles of a cylinder ferromagnet of radius a and thickness h.
+
+    r_nodes (2, nr) and z_nodes (3, nz) hold the nodes of the patches r<a, r>a and
+    z<-h, -h<z<0, z>0; values (2, 3, 4, nr, nz) holds the four profiles on each patch
+    and error (2, 3, 4) the largest interpolation error of each profile, measured
+    against the exact solver at the centres of the cells the table answers.
+    exact (2, 3, nr-1, nz-1) marks the cells left to the exact solver, as do points
+    closer than rim*a to the edges of the faces, where the profiles diverge
+    logarithmically """
+
+    def __init__(self, a, h, r_nodes, z_nodes, values, error, rim, exact):
+        self.a = a
+        self.h = h
+        self.r_nodes = r_nodes
+        self.z_nodes = z_nodes
+        self.values = values
+        self.error = error
+        self.rim = rim
+        self.exact = exact
+
+    @classmethod
+    def build(cls, a=1, h=1, n_r=256, n_z=256, extent=4.0, r_min=0.01, rim=0.01,
+              target=1e-3):
+        """ Tabulate the profiles out to extent*max(a, h) beyond the magnet. Cells whose
+        error at the centre is above target for any profile, and their neighbours, are
+        left to the exact solver; this takes out the region near the axis, where the
+        in-plane profiles grow like 1/r**2, and the close surroundings of the rim """
+        a = float(a)
+        h = float(h)
+        L = extent*max(a, h)
+        r_nodes = np.array([_nodes(r_min*a, a, n_r),
+                            _nodes(a, a+L, n_r, dense_hi=False)])
+        z_nodes = np.array([_nodes(-h-L, -h, n_z, dense_lo=False),
+                            _nodes(-h, 0, n_z),
+                            _nodes(0, L, n_z, dense_hi=False)])
+        values = np.empty((2, 3, 4, n_r, n_z))
+        error = np.empty((2, 3, 4))
+        exact = np.empty((2, 3, n_r-1, n_z-1), dtype=bool)
+        for ir, rn in enumerate(r_nodes):
+            for iz, zn in enumerate(z_nodes):
+                # the end nodes take the limit from inside the patch, the profiles step
+                # across the faces and the rim
+                eps = 1e-9*L
+                rn_eval = np.concatenate(([rn[0]+eps], rn[1:-1], [rn[-1]-eps]))
+                zn_eval = np.concatenate(([zn[0]+eps], zn[1:-1], [zn[-1]-eps]))
+                values[ir, iz] = _rz_profiles(rn_eval[:, None], zn_eval[None, :], a, h)
+                r_mid = 0.5*(rn[1:]+rn[:-1])
+                z_mid = 0.5*(zn[1:]+zn[:-1])
+                ref = np.array(_rz_profiles(r_mid[:, None], z_mid[None, :], a, h))
+                v = values[ir, iz]
+                approx = 0.25*(v[:, 1:, 1:]+v[:, :-1, 1:]+v[:, 1:, :-1]+v[:, :-1, :-1])
+                err = abs(approx-ref)
+                err[:, _near_rim(r_mid[:, None], z_mid[None, :], a, h, rim)] = 0
+                # nan counts as a miss; the neighbours go as well, the centre does not
+                # see the worst error of a cell next to a steep region
+                bad = ~(err <= target).all(axis=0)
+                grown = bad.copy()
+                grown[1:] |= bad[:-1]
+                grown[:-1] |= bad[1:]
+                rows = grown.copy()
+                grown[:, 1:] |= rows[:, :-1]
+                grown[:, :-1] |= rows[:, 1:]
+                exact[ir, iz] = grown
+                err[:, grown] = 0
+                error[ir, iz] = err.reshape(4, -1).max(axis=1)
+        return cls(a, h, r_nodes, z_nodes, values, error, rim, exact)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """ Read a table written by save; the profiles are memory-mapped by default """
+        meta = np.load(path+'.npz')
+        values = np.load(path+'.npy', mmap_mode=mmap_mode)
+        return cls(float(meta['a']), float(meta['h']), meta['r_nodes'], meta['z_nodes'],
+                   values, meta['error'], float(meta['rim']), meta['exact'])
+
+    def save(self, path):
+        """ Write the table to path.npy and path.npz """
+        np.save(path+'.npy', np.asarray(self.values))
+        np.savez(path+'.npz', a=self.a, h=self.h, r_nodes=self.r_nodes,
+                 z_nodes=self.z_nodes, error=self.error, rim=self.rim, exact=self.exact)
+
+    @classmethod
+    def cached(cls, a=1, h=1, cache_dir='field_tables', **grid):
+        """ Load the table for (a, h), the grid options of build and the current solver
+        from cache_dir, building and storing it on the first call """
+        spec = dict(n_r=256, n_z=256, extent=4.0, r_min=0.01, rim=0.01, target=1e-3)
+        spec.update(grid)
+        key = repr((float(a), float(h), sorted(spec.items()), solver_version()))
+        name = 'field_table_a%g_h%g_%s' % (a, h, hashlib.sha1(key.encode()).hexdigest()[:12])
+        path = os.path.join(cache_dir, name)
+        if os.path.exists(path+'.npy') and os.path.exists(path+'.npz'):
+            return cls.load(path)
+        table = cls.build(a, h, **spec)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        table.save(path)
+        return table
+
+    @property
+    def error_bound(self):
+        """ Largest error of any field component for unit magnetisation in any direction,
+        as measured at the centres of the cells the table answers. Points answered by
+        the exact solver are exact """
+        e_zr, e_zz, e_xr, e_xphi = self.error.reshape(-1, 4).max(axis=0)
+        return max(e_zr, e_zz)+max(e_xr+e_xphi, e_zr)
+
+    def profiles(self, r, z):
+        """ The interpolated profiles (4, ...) at (r, z), NaN where the table has no data """
+        r, z = np.broadcast_arrays(np.asarray(r, dtype=float), np.asarray(z, dtype=float))
+        shape = r.shape
+        r, z = r.ravel(), z.ravel()
+        out = np.full((4, r.size), np.nan)
+        covered = ((r >= self.r_nodes[0, 0]) & (r <= self.r_nodes[1, -1])
+                   & (z >= self.z_nodes[0, 0]) & (z <= self.z_nodes[2, -1])
+                   & ~_near_rim(r, z, self.a, self.h, self.rim))
+        patch_r = (r >= self.a).astype(int)
+        patch_z = np.where(z >= 0, 2, np.where(z >= -self.h, 1, 0))
+        for ir in range(2):
+            for iz in range(3):
+                sel = np.nonzero(covered & (patch_r == ir) & (patch_z == iz))[0]
+                i, j = _cells(self.r_nodes[ir], self.z_nodes[iz], r[sel], z[sel])
+                # cells whose error is above the target of build stay NaN
+                keep = ~self.exact[ir, iz, i, j]
+                sel, i, j = sel[keep], i[keep], j[keep]
+                out[:, sel] = _interpolate(self.r_nodes[ir], self.z_nodes[iz],
+                                           self.values[ir, iz], r[sel], z[sel], i, j)
+        return out.reshape((4,)+shape)
+
+    def basis(self, x, y, z):
+        """ The (3, 3, ...) basis fields of h_field_strength._H_basis from the table """
+        r, cos_phi, sin_phi, z = _polar(x, y, z)
+        prof = self.profiles(r, z)
+        missing = np.isnan(prof[0])
+        if np.any(missing):
+            prof[:, missing] = _rz_profiles(r[missing], z[missing], self.a, self.h)
+        return _assemble_basis(cos_phi, sin_phi, *prof)
+
+    def field(self, x, y, z, theta=np.pi/4, psi=0, m=1):
+        """ (Hx, Hy, Hz) stacked in one array, for magnetisation m at polar angle theta
+        and azimuth psi """
+        return m*combine_basis(self.basis(x, y, z), theta, psi)
@@ -0,0 +1,146 @@
+"""
+Loop timing instrumentation of CEPfastloop.
+
+Durations are counted into fixed log-spaced histograms, so recording one costs a
+clock read and a few float operations whatever the run time, and the memory stays
+constant. A LoopTimer keeps one histogram per stage of the tick, plus the
+tick-to-tick interval and its jitter, the deviation from the nominal timer period:
+
+    timer = LoopTimer(period=0.1)
+    timer.tick()            # at the start of each tick
+    readADC()
+    timer.lap('readADC')    # time since the tick started or the last lap
+    print(timer.summary())
+    timer.save(timing_path('/home/pi/CEPfastloop_logs', '2016-03-14'))
+
+The saved .npz files sit next to the daily logs of binlog and load back with
+load_timing.
+"""
+
+import os
+import math
+import time
+import numpy as np
+
+# a monotonic high resolution clock where there is one (python 3)
+clock = getattr(time, 'perf_counter', time.time)
+
+
+class Histogram(object):
+    """ Counts of durations (s) in per_decade log-spaced bins from lo to hi, with an
+    underflow bin in front and an overflow bin at the end """
+
+    def __init__(self, lo=1e-6, hi=10., per_decade=20):
+        self.lo = lo
+        self.per_decade = per_decade
+        self.nbins = int(round(math.log10(hi / lo) * per_decade))
+        self.counts = np.zeros(self.nbins + 2, dtype=np.int64)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, value):
+        """ Count one duration """
+        if value > self.lo:
+            i = min(int(math.log10(value / self.lo) * self.per_decade) + 1, self.nbins + 1)
+        else:
+            i = 0
+        self.counts[i] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def edges(self):
+        """ The nbins+1 bin edges between the underflow and the overflow bin """
+        return self.lo * 10 ** (np.arange(self.nbins + 1) / float(self.per_decade))
+
+    def quantile(self, q):
+        """ Upper edge of the bin holding the q-quantile (at most max), nan while empty """
+        if not self.count:
+            return np.nan
+        i = np.searchsorted(np.cumsum(self.counts), q * self.count)
+        return self.max if i > self.nbins else min(self.edges()[i], self.max)
+
+    def mean(self):
+        return self.total / self.count if self.count else np.nan
+
+
+class LoopTimer(object):
+    """ Stage durations and tick intervals of a loop ticking every period s """
+
+    def __init__(self, period, lo=1e-6, hi=10., per_decade=20):
+        self.period = period
+        self._bins = (lo, hi, per_decade)
+        self.histograms = {}
+        self.stages = []    # stage names in the order they were first seen
+        self.started = time.time()
+        self._tick = None
+        self._mark = None
+
+    def histogram(self, name):
+        """ The histogram of name, created on first use """
+        if name not in self.histograms:
+            self.histograms[name] = Histogram(*self._bins)
+            self.stages.append(name)
+        return self.histograms[name]
+
+    def tick(self):
+        """ Start of a tick: count the interval since the previous one """
+        now = clock()
+        if self._tick is not None:
+            interval = now - self._tick
+            self.histogram('interval').add(interval)
+            self.histogram('jitter').add(abs(interval - self.period))
+        self._tick = now
+        self._mark = now
+
+    def lap(self, name):
+        """ Count the time since the tick started or the last lap as stage name """
+        now = clock()
+        self.histogram(name).add(now - self._mark)
+        self._mark = now
+
+    def measure(self, name, func, *args):
+        """ Call func, counting its duration as stage name, outside the tick """
+        start = clock()
+        result = func(*args)
+        self.histogram(name).add(clock() - start)
+        return result
+
+    def summary(self):
+        """ One line per histogram: count, mean, median, 99th percentile and max (ms) """
+        lines = ["%-10s %7s %7s %7s %7s %7s" % ('ms', 'n', 'mean', 'p50', 'p99', 'max')]
+        for name in self.stages:
+            h = self.histograms[name]
+            lines.append("%-10s %7i %7.2f %7.2f %7.2f %7.2f" % (
+                name, h.count, 1e3 * h.mean(), 1e3 * h.quantile(0.5), 1e3 * h.quantile(0.99), 1e3 * h.max))
+        return '\n'.join(lines)
+
+    def save(self, path):
+        """ Write the histograms to path (.npz), replacing the file in one step """
+        arrays = {'started': self.started, 'saved': time.time(), 'period': self.period,
+                  'stages': np.array(self.stages)}
+        if self.stages:
+            arrays['edges'] = self.histograms[self.stages[0]].edges()
+        for name in self.stages:
+            h = self.histograms[name]
+            arrays['counts_' + name] = h.counts
+            arrays['stats_' + name] = np.array([h.count, h.total, h.max])
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, **arrays)
+        os.rename(tmp, path)
+
+
+def timing_path(directory, day, prefix='CEPfastloop'):
+    """ file of the timing histograms of day, a 'YYYY-MM-DD' string """
+    return os.path.join(directory, '%s_timing_%s.npz' % (prefix, day))
+
+
+def load_timing(path):
+    """ The saved histograms as a dict of stage name to (edges, counts, count, total,
+    max), the counts including the under- and overflow bins """
+    with np.load(path) as f:
+        return dict((str(name), (f['edges'], f['counts_' + name]) + tuple(f['stats_' + name]))
+                    for name in f['stages'])
@@ -0,0 +1,194 @@
+"""
+Field of an assembly of cylinder ferromagnets at arbitrary positions and orientations.
+
+    magnets = [CylinderMagnet(1, 0.5, 0.2, 0) for i in range(100)]
+    assembly = MagnetArray(magnets, positions, orientations, tol=1e-3)
+    Hx, Hy, Hz = assembly.field(x, y, z)
+
+The magnets are kept in a k-d tree. Every node carries the total dipole moment of its
+magnets and their spread around the node centre (the first correction term of the
+group), so points far enough from a node get the field of the whole group in one go,
+Barnes-Hut style. Points that come closer are handed down the tree; at the leaves each
+magnet is a point dipole when that meets tol and otherwise goes into one batched call
+of the exact solver over all the close magnet-point pairs. For points spread over the
+array the cost grows like N log M rather than N*M.
+
+tol bounds the error of the multipole terms relative to sum(|mu|)/d**3, the field
+scale of the magnets they stand for, against the exact path. Two conditions make a
+node or magnet far enough. First, the group truncation 3*(R/d)**2 <= tol for a
+bounding sphere of radius R. Second, the dipole has to match the solver itself. For
+every magnet shape, _dipole_range measures how far from the magnet the dipole and
+the solver of h_field_strength agree within tol, over a spread of directions, and
+nothing closer is approximated. Off the axis that solver does not fall off like a
+dipole at large distance (see the reference check of bench_field.py). So for now
+that distance is infinite, and every pair goes to the exact solver whatever tol is.
+The multipole terms come into play by themselves once the solver's far field is
+dipolar. tol=0 skips the calibration and uses the solver for every pair.
+"""
+
+import numpy as np
+from h_field_strength import _H_kernel
+
+
+def _multipole(R, mu, Q=None):
+    """ Field at the offsets R (3, n) from dipoles mu (3, n) or (3, 1). Q (3, 3) is the
+    moment tensor sum(delta_k*mu_l) of a group of dipoles at offsets delta from the
+    origin and adds their first correction """
+    r2 = (R*R).sum(0)
+    inv3 = r2**-1.5
+    H = (3*R*(mu*R).sum(0)/r2-mu)*inv3
+    if Q is not None:
+        QR = np.dot(Q, R)
+        RQR = (R*QR).sum(0)
+        H -= (-15*R*RQR/r2+3*(np.dot(Q.T, R)+R*np.trace(Q)+QR))*inv3/r2
+    return H
+
+
+def _dipole_range(a, h, tol, n_theta=16, n_phi=4, q_max=1e4):
+    """ Distance from the centre of a cylinder (a, h) beyond which its point dipole
+    matches the solver to tol, relative to the dipole field scale, for both
+    magnetisation directions; inf if it does not within q_max bounding radii """
+    reach = np.hypot(a, 0.5*h)
+    q = np.logspace(0, np.log10(q_max), 41)
+    theta = np.linspace(0, np.pi, n_theta)
+    phi = np.linspace(0, np.pi, n_phi)
+    q_, theta_, phi_ = [g.ravel() for g in np.meshgrid(q, theta, phi, indexing='ij')]
+    R = reach*q_*np.array([np.sin(theta_)*np.cos(phi_), np.sin(theta_)*np.sin(phi_),
+                           np.cos(theta_)])
+    H_zx,H_zy,H_zz,H_xx,H_xy,H_xz = _H_kernel(R[0], R[1], R[2]-0.5*h, a, h)
+    mu = np.pi*a**2*h
+    err = np.zeros(len(q))
+    for H, m in (((H_zx, H_zy, H_zz), [[0], [0], [mu]]), ((H_xx, H_xy, H_xz), [[mu], [0], [0]])):
+        D = _multipole(R, np.array(m, dtype=float))
+        dev = np.abs(np.array(H)-D).max(0).reshape(len(q), -1).max(1)
+        err = np.maximum(err, dev/(mu/(reach*q)**3))
+    ok = ~(err > tol)   # nan counts as a miss
+    if not ok[-1]:
+        return np.inf
+    bad = np.nonzero(~ok)[0]
+    return reach*(q[bad[-1]+1] if bad.size else q[0])
+
+
+class _Node(object):
+    """ One node of the k-d tree of MagnetArray """
+    __slots__ = ('center', 'radius', 'near', 'moment', 'Q', 'children', 'members')
+
+
+def _build(idx, centers, reach, near, moments, leaf_size):
+    """ k-d tree of the magnets idx, split at the median along the widest extent """
+    node = _Node()
+    c = centers[idx]
+    node.center = 0.5*(c.min(0)+c.max(0))
+    delta = c-node.center
+    node.radius = np.max(np.sqrt((delta**2).sum(1))+reach[idx])
+    # closer than this some member's dipole no longer matches the solver
+    node.near = np.max(np.sqrt((delta**2).sum(1))+near[idx])
+    node.moment = moments[idx].sum(0)
+    node.Q = np.dot(delta.T, moments[idx])
+    node.children = ()
+    node.members = idx
+    if len(idx) > leaf_size:
+        order = idx[np.argsort(c[:, np.argmax(np.ptp(c, axis=0))], kind='stable')]
+        half = len(idx)//2
+        node.children = (_build(order[:half], centers, reach, near, moments, leaf_size),
+                         _build(order[half:], centers, reach, near, moments, leaf_size))
+    return node
+
+
+class MagnetArray(object):
+    """ Cylinder ferromagnets at positions (M, 3), the centres of the magnets, i.e. the
+    point (0, 0, -h/2) of the frame of CylinderMagnet. orientations (M, 3, 3) holds the
+    rotation matrices from the frame of each magnet to the lab frame and defaults to
+    the identity. tol is the error allowed to the multipole terms, 0 for the exact
+    solver everywhere; leaf_size the number of magnets per leaf of the tree """
+
+    def __init__(self, magnets, positions, orientations=None, tol=1e-3, leaf_size=8,
+                 chunk_size=2**16):
+        M = len(magnets)
+        self.magnets = list(magnets)
+        self.positions = np.asarray(positions, dtype=float).reshape(M, 3)
+        if orientations is None:
+            orientations = np.broadcast_to(np.eye(3), (M, 3, 3))
+        self.orientations = np.asarray(orientations, dtype=float).reshape(M, 3, 3)
+        self.tol = tol
+        self.chunk_size = chunk_size
+        self.m = np.array([float(mag.m) for mag in self.magnets])
+        self.a = np.array([float(mag.a) for mag in self.magnets])
+        self.h = np.array([float(mag.h) for mag in self.magnets])
+        self.theta = np.array([float(mag.theta) for mag in self.magnets])
+        #moments in the lab frame and radii of the bounding spheres
+        local = np.array([np.sin(self.theta), np.zeros(M), np.cos(self.theta)])
+        self.moments = np.einsum('kij,jk->ki', self.orientations,
+                                 local*self.m*np.pi*self.a**2*self.h)
+        self.reach = np.hypot(self.a, 0.5*self.h)
+        #distance from each magnet beyond which its dipole matches the solver to tol
+        ranges = {}
+        for shape in set(zip(self.a, self.h)):
+            ranges[shape] = np.inf if tol <= 0 else _dipole_range(shape[0], shape[1], tol)
+        self.near = np.array([ranges[shape] for shape in zip(self.a, self.h)])
+        self._root = _build(np.arange(M), self.positions, self.reach, self.near, self.moments,
+                            leaf_size)
+
+    def __len__(self):
+        return len(self.magnets)
+
+    def _far(self, R, radius, near):
+        """ True where a multipole of the given radius, whose dipoles match the solver
+        beyond near, is good enough at offsets R """
+        d2 = (R*R).sum(0)
+        return (3*radius**2 <= self.tol*d2) & (d2 >= near**2)
+
+    def field(self, x, y, z):
+        """ (Hx, Hy, Hz) of all the magnets at the points x, y, z """
+        x, y, z = np.broadcast_arrays(np.asarray(x, dtype=float),
+                                      np.asarray(y, dtype=float),
+                                      np.asarray(z, dtype=float))
+        shape = x.shape
+        P = np.array([x.ravel(), y.ravel(), z.ravel()])
+        N = P.shape[1]
+        H = np.zeros((3, N))
+        exact, dipole = [], []
+        stack = [(self._root, np.arange(N))]
+        while stack:
+            node, idx = stack.pop()
+            R = P[:, idx]-node.center[:, None]
+            far = self._far(R, node.radius, node.near)
+            if np.any(far):
+                H[:, idx[far]] += _multipole(R[:, far], node.moment[:, None], node.Q)
+                idx = idx[~far]
+            if idx.size == 0:
+                continue
+            if node.children:
+                stack.extend((child, idx) for child in node.children)
+                continue
+            for k in node.members:
+                near = ~self._far(P[:, idx]-self.positions[k, :, None], self.reach[k], self.near[k])
+                exact.append((idx[near], np.full(np.count_nonzero(near), k)))
+                dipole.append((idx[~near], np.full(np.count_nonzero(~near), k)))
+        for pairs, evaluate in ((dipole, self._dipole_pairs), (exact, self._exact_pairs)):
+            if not pairs:
+                continue
+            p = np.concatenate([pk[0] for pk in pairs])
+            k = np.concatenate([pk[1] for pk in pairs])
+            for s in range(0, p.size, self.chunk_size):
+                ps, ks = p[s:s+self.chunk_size], k[s:s+self.chunk_size]
+                Hs = evaluate(P[:, ps], ks)
+                for i in range(3):
+                    H[i] += np.bincount(ps, Hs[i], minlength=N)
+        return H[0].reshape(shape), H[1].reshape(shape), H[2].reshape(shape)
+
+    def _dipole_pairs(self, P, k):
+        """ point-dipole field of the magnets k at the points P (3, n) """
+        return _multipole(P-self.positions[k].T, self.moments[k].T)
+
+    def _exact_pairs(self, P, k):
+        """ field of the magnets k at the points P (3, n) from the exact solver """
+        rot = self.orientations[k]
+        local = np.einsum('nji,jn->in', rot, P-self.positions[k].T)
+        local[2] -= 0.5*self.h[k]
+        H_zx,H_zy,H_zz,H_xx,H_xy,H_xz = _H_kernel(local[0], local[1], local[2],
+                                                  self.a[k], self.h[k])
+        c = self.m[k]*np.cos(self.theta[k])
+        s = self.m[k]*np.sin(self.theta[k])
+        H = np.array([H_zx*c+H_xx*s, H_zy*c+H_xy*s, H_zz*c+H_xz*s])
+        return np.einsum('nij,jn->in', rot, H)
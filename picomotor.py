@@ -0,0 +1,165 @@
+"""
+Non-blocking command queue for the New Focus picomotor controller of CEPfastloop.
+
+All serial traffic goes through one worker thread. Callers queue commands and get
+a concurrent.futures.Future back straight away. Relative moves that are waiting in
+the queue behind each other are merged into a single REL/GO. After a move the worker
+polls the motion-done query until the controller reports the motor has stopped,
+and only then resolves the futures and sends the next command:
+
+    pico = PicomotorQueue(serial.Serial("/dev/ttyUSB0", baudrate=19200, timeout=3.0))
+    pico.initialise(acceleration=150, min_velocity=0, max_velocity=2000)
+    done = pico.move(20)        # returns at once
+    done.result()               # 20 once the motor has stopped
+"""
+
+import time
+import threading
+import collections
+from concurrent.futures import Future
+
+
+class PicomotorQueue(threading.Thread):
+    """ Worker thread owning the serial port ser of a picomotor controller, driving
+    motor 0 of channel. Moves time out after move_timeout seconds of polling """
+
+    done_query = 'MD?'      # motion done, the reply ends in 1 once the motor stopped
+    poll_interval = 0.02    # s between motion-done queries
+    command_gap = 0.05      # s the controller needs between two commands
+    init_delay = 10.        # s the controller needs after INI
+
+    def __init__(self, ser, channel='A1', move_timeout=60.):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.ser = ser
+        self.channel = channel
+        self.move_timeout = move_timeout
+        self._commands = collections.deque()
+        self._cond = threading.Condition()
+        self._stopping = False
+        self.start()
+
+    def _submit(self, kind, arg):
+        future = Future()
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError("picomotor queue is stopped")
+            self._commands.append((kind, arg, future))
+            self._cond.notify()
+        return future
+
+    def send(self, command):
+        """ Queue a command without reply; the future resolves once it was written """
+        return self._submit('send', command)
+
+    def query(self, command):
+        """ Queue a query; the future resolves to the reply line """
+        return self._submit('query', command)
+
+    def move(self, steps):
+        """ Queue a relative move; the future resolves to the number of steps of the
+        (possibly merged) move it went out with, once the motor has stopped """
+        return self._submit('move', int(steps))
+
+    def pending_steps(self):
+        """ Sum of the relative moves still waiting in the queue """
+        with self._cond:
+            return sum(arg for kind, arg, future in self._commands if kind == 'move')
+
+    def initialise(self, acceleration, min_velocity, max_velocity):
+        """ Queue the controller setup; returns the future of its last command """
+        self.send('INI')
+        self._submit('wait', self.init_delay)
+        self.send('ECHO OFF')
+        self.send('CHL %s=0' % self.channel)
+        self.send('ACC %s 0=%i' % (self.channel, acceleration))  # 16 20000 steps/s^2
+        self.send('MPV %s 0=%i' % (self.channel, min_velocity))  # 0 1999 Hz
+        return self.send('VEL %s 0=%i' % (self.channel, max_velocity))  # 1 2000 Hz
+
+    def stop(self, timeout=5.):
+        """ Cancel the queued commands and end the worker after the current one """
+        with self._cond:
+            self._stopping = True
+            while self._commands:
+                self._commands.popleft()[2].cancel()
+            self._cond.notify()
+        if self.is_alive():
+            self.join(timeout)
+
+    def _write(self, command):
+        self.ser.write((command + '\r\n').encode('ascii'))
+        time.sleep(self.command_gap)
+
+    def _readline(self):
+        return self.ser.readline().decode('ascii', 'replace').strip()
+
+    def _flush_input(self):
+        """ drop whatever the controller sent unasked, e.g. the echoes of the commands
+        before ECHO OFF, so a reply is never taken for that of a later query """
+        if hasattr(self.ser, 'reset_input_buffer'):
+            self.ser.reset_input_buffer()
+        else:
+            self.ser.flushInput()   # pyserial < 3.0
+
+    def _query(self, command, gap=None):
+        """ the reply line to command, skipping an echo of the command itself """
+        self._flush_input()
+        self.ser.write((command + '\r\n').encode('ascii'))
+        time.sleep(self.command_gap if gap is None else gap)
+        reply = self._readline()
+        if reply == command:
+            reply = self._readline()
+        return reply
+
+    def _wait_motion_done(self):
+        """ poll the controller until the motor stopped """
+        deadline = time.time() + self.move_timeout
+        while time.time() < deadline:
+            if self._query(self.done_query, gap=0).endswith('1'):
+                return
+            time.sleep(self.poll_interval)
+        raise RuntimeError("picomotor move did not finish within %g s" % self.move_timeout)
+
+    def _next(self):
+        """ the next command, with the moves queued right behind a move merged in """
+        with self._cond:
+            while not self._commands and not self._stopping:
+                self._cond.wait()
+            if not self._commands:
+                return None
+            kind, arg, future = self._commands.popleft()
+            futures = [future]
+            if kind == 'move':
+                while self._commands and self._commands[0][0] == 'move':
+                    arg += self._commands[0][1]
+                    futures.append(self._commands.popleft()[2])
+        return kind, arg, [f for f in futures if f.set_running_or_notify_cancel()]
+
+    def run(self):
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            kind, arg, futures = item
+            try:
+                if kind == 'send':
+                    self._write(arg)
+                    result = None
+                elif kind == 'query':
+                    result = self._query(arg)
+                elif kind == 'wait':
+                    time.sleep(arg)
+                    result = None
+                elif arg != 0:
+                    self._write('REL %s %i' % (self.channel, arg))
+                    self._write('GO')
+                    self._wait_motion_done()
+                    result = arg
+                else:
+                    result = 0
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+            else:
+                for future in futures:
+                    future.set_result(result)
@@ -0,0 +1,70 @@
+"""
+Preallocated ring buffer for the CEPfastloop sample streams and histories.
+
+One thread appends, any number of threads read, without locks: every value is
+stored twice, at i and i+capacity, so the last n values always form one contiguous
+slice, and the writer publishes a value by bumping count only after storing it.
+Appending costs the same whatever the capacity, and the ordered history is
+available as a view without copying.
+"""
+
+import numpy as np
+
+
+class RingBuffer(object):
+    """ The last capacity values of a stream, of any numpy dtype (e.g. a record of
+    time and voltage). count is the number of values appended so far.
+
+    A reader copying a window of n values is safe while fewer than capacity-n new
+    values arrive during the copy, so keep capacity well above the windows read """
+
+    def __init__(self, capacity, dtype=float):
+        self.capacity = int(capacity)
+        self.dtype = np.dtype(dtype)
+        self._buf = np.zeros(2*self.capacity, dtype=self.dtype)
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, value):
+        """ Store one value, overwriting the oldest once full """
+        i = self.count % self.capacity
+        self._buf[i] = value
+        self._buf[i+self.capacity] = value
+        self.count += 1
+
+    def extend(self, values):
+        """ Store a batch of values in order """
+        values = np.asarray(values, dtype=self.dtype)
+        n = len(values)
+        values = values[-self.capacity:]
+        i = (self.count+n-len(values)+np.arange(len(values))) % self.capacity
+        self._buf[i] = values
+        self._buf[i+self.capacity] = values
+        self.count += n
+
+    def _window(self, end_count, n):
+        """ the n values before the end_count-th, as a slice of the buffer """
+        n = min(n, end_count, self.capacity)
+        end = end_count % self.capacity+self.capacity
+        return self._buf[end-n:end]
+
+    def view(self, n=None):
+        """ Read-only view of the last n values (all kept values by default), oldest
+        first. It is not a copy: the writer keeps overwriting the memory behind it,
+        take latest for a snapshot """
+        window = self._window(self.count, self.capacity if n is None else n)
+        window = window.view()
+        window.flags.writeable = False
+        return window
+
+    def latest(self, n):
+        """ Copy of the last n values (fewer if not that many were appended yet) """
+        return self._window(self.count, n).copy()
+
+    def since(self, count):
+        """ Copy of the values appended after the count-th (at most capacity of them)
+        and the current count, to pass to the next call """
+        now = self.count
+        return self._window(now, now-count).copy(), now
@@ -1,41 +1,20 @@
 import numpy as np
 import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import axes3d
-from h_field_strength import H_spherical_ferromag as H
+from h_field_strength import CylinderMagnet
+from field_plot import spherical_grid, field_quiver
 
 m = 1       #volume magnetisation
 a = 1       #radius of the ferromagnet
 h = 1     #thickness of the ferromagnet
 theta = np.pi/4 #angle of the magnetisation
+magnet = CylinderMagnet(m, a, h, theta)
 
-value = 1e1
-rho = np.array([20 for i in np.arange(value)])
+value = 10
+rho = 20
 theta0 = np.linspace(0,np.pi,value)
 phi0 = np.linspace(0,np.pi*2,value)
-x0 = rho*np.sin(theta0)*np.cos(phi0)+1
-y0= rho*np.sin(theta0)*np.sin(phi0)+1
-z0 = rho*np.cos(theta0)+1
 
-
-x = []
-y = []
-z = []
-for i in rho:
-    for j in theta0:
-        for k in phi0:
-            x.append(i*np.sin(j)*np.cos(k)+1)
-            y.append(i*np.sin(j)*np.sin(k)+1)
-            z.append(i*np.cos(j)+1)
-
-hx = H(np.array(x),np.array(y),np.array(z))[0]
-hy = H(np.array(x),np.array(y),np.array(z))[1]
-hz = H(np.array(x),np.array(y),np.array(z))[2]
-x = np.array(x)
-y = np.array(y)
-z = np.array(z)
-
-fig = plt.figure(dpi = 100)
-ax = fig.gca(projection='3d')
-xx, yy, zz = np.meshgrid(x0,y0,z0)
-ax.quiver(x, y, z, hx, hy, hz, length=1, arrow_length_ratio=0.5,normalize=True,colors=(1,0,1))
+#shell of radius rho around (1,1,1), the solver is called once inside field_quiver
+x, y, z = spherical_grid(rho, theta0, phi0, center=(1,1,1))
+field_quiver(x, y, z, magnet, length=1, arrow_length_ratio=0.5, colors=(1,0,1))
 plt.show()
\ No newline at end of file
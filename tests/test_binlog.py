@@ -0,0 +1,43 @@
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from binlog import BinaryLogger, read_log, log_path
+
+RECORD = [('time', 'f8'), ('value', 'f8')]
+DAY = '2016-03-14'
+
+
+def records(start, n):
+    t0 = time.mktime((2016, 3, 14, 12, 0, 0, 0, 0, -1))
+    r = np.zeros(n, dtype=RECORD)
+    r['time'] = t0 + np.arange(start, start + n)
+    r['value'] = np.arange(start, start + n)
+    return r
+
+
+def write(directory, r):
+    logger = BinaryLogger(str(directory), RECORD, flush_interval=0.01)
+    logger.log(r)
+    logger.stop()
+
+
+def test_roundtrip(tmpdir):
+    write(tmpdir, records(0, 10))
+    write(tmpdir, records(10, 5))
+    log = read_log(str(tmpdir), DAY)
+    assert np.array_equal(log['value'], np.arange(15))
+    assert np.array_equal(np.load(log_path(str(tmpdir), DAY))['value'], np.arange(15))
+
+
+def test_partial_record_is_dropped(tmpdir):
+    write(tmpdir, records(0, 10))
+    with open(log_path(str(tmpdir), DAY), 'ab') as f:
+        f.write(b'\x01' * 5)    # a write cut short by a crash
+    write(tmpdir, records(10, 10))
+    log = read_log(str(tmpdir), DAY)
+    assert np.array_equal(log['value'], np.arange(20))
+    assert np.array_equal(np.load(log_path(str(tmpdir), DAY))['value'], np.arange(20))
@@ -0,0 +1,67 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import field_stream
+from h_field_strength import CylinderMagnet
+from field_stream import field_stream as stream
+
+
+def setup_files(tmp_path, n=1000):
+    rng = np.random.RandomState(0)
+    ins = [str(tmp_path / ('%s.npy' % c)) for c in 'xyz']
+    for path, values in zip(ins, rng.uniform(0.2, 2, (3, n))):
+        np.save(path, values)
+    outs = [str(tmp_path / ('h%s.npy' % c)) for c in 'xyz']
+    return ins, outs
+
+
+def interrupted(ins, outs, magnet, after):
+    """ run until after points are done, then fail like a crash """
+    calls = []
+    real = field_stream.field_parallel
+
+    def failing(*args, **kwargs):
+        if calls:
+            raise KeyboardInterrupt
+        calls.append(1)
+        return real(*args, **kwargs)
+    field_stream.field_parallel = failing
+    try:
+        with pytest.raises(KeyboardInterrupt):
+            stream(*ins, out_paths=outs, block_size=after, magnet=magnet)
+    finally:
+        field_stream.field_parallel = real
+
+
+def expected(ins, magnet):
+    return np.array(magnet.field(*[np.load(p) for p in ins]))
+
+
+def test_resume_finishes_the_same_job(tmp_path):
+    ins, outs = setup_files(tmp_path)
+    magnet = CylinderMagnet(1, 1., 1., 0.3)
+    interrupted(ins, outs, magnet, 500)
+    assert os.path.exists(outs[0] + '.progress')
+    stream(*ins, out_paths=outs, block_size=500, magnet=magnet)
+    np.testing.assert_array_equal([np.load(p) for p in outs], expected(ins, magnet))
+
+
+def test_another_magnet_starts_over(tmp_path):
+    ins, outs = setup_files(tmp_path)
+    interrupted(ins, outs, CylinderMagnet(1, 1., 1., 0.3), 500)
+    other = CylinderMagnet(2, 1., 1., 1.2)
+    stream(*ins, out_paths=outs, block_size=500, magnet=other)
+    np.testing.assert_array_equal([np.load(p) for p in outs], expected(ins, other))
+
+
+def test_outputs_of_another_shape_start_over(tmp_path):
+    ins, outs = setup_files(tmp_path)
+    magnet = CylinderMagnet(1, 1., 1., 0.3)
+    interrupted(ins, outs, magnet, 500)
+    np.save(outs[1], np.zeros(10, dtype=np.float32))
+    stream(*ins, out_paths=outs, block_size=500, magnet=magnet)
+    np.testing.assert_array_equal([np.load(p) for p in outs], expected(ins, magnet))
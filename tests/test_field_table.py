@@ -0,0 +1,32 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import field_table
+from h_field_strength import CylinderMagnet
+from field_table import FieldTable
+
+
+def test_error_bound_holds_and_is_small():
+    table = FieldTable.build(1., 1., n_r=128, n_z=128, target=1e-3)
+    assert table.error_bound < 1e-2
+    rng = np.random.RandomState(0)
+    x, y = rng.uniform(-3, 3, (2, 20000))
+    z = rng.uniform(-3, 2, 20000)
+    exact = np.array(CylinderMagnet(1, 1., 1., np.pi/4).field(x, y, z))
+    H = table.field(x, y, z, theta=np.pi/4)
+    assert np.nanmax(abs(H - exact)) <= table.error_bound
+    # the axis is left to the solver
+    assert np.isnan(table.profiles(1e-3, -0.5)).all()
+
+
+def test_cached_key_follows_the_solver_version(tmp_path, monkeypatch):
+    grid = dict(n_r=16, n_z=16, cache_dir=str(tmp_path))
+    FieldTable.cached(1., 1., **grid)
+    FieldTable.cached(1., 1., **grid)
+    assert len(os.listdir(str(tmp_path))) == 2
+    monkeypatch.setattr(field_table, 'solver_version', lambda: 'changed')
+    FieldTable.cached(1., 1., **grid)
+    assert len(os.listdir(str(tmp_path))) == 4
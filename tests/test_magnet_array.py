@@ -0,0 +1,53 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import magnet_array
+from h_field_strength import CylinderMagnet
+from magnet_array import MagnetArray
+
+
+def dipole_kernel(x, y, z, a, h, dtype=np.float64):
+    """ _H_kernel of a point dipole at the centre of the magnet, a solver whose far
+    field is dipolar """
+    R = np.array(np.broadcast_arrays(x, y, z+0.5*h), dtype=float)
+    mu = np.pi*a**2*h
+    H_z = magnet_array._multipole(R, np.array([[0.], [0.], [1.]])*mu)
+    H_x = magnet_array._multipole(R, np.array([[1.], [0.], [0.]])*mu)
+    return tuple(H_z)+tuple(H_x)
+
+
+def test_tol_bounds_the_deviation_from_the_exact_path(monkeypatch):
+    monkeypatch.setattr(magnet_array, '_H_kernel', dipole_kernel)
+    calls = {'Q': 0, 'dipole': 0}
+    multipole = magnet_array._multipole
+
+    def counting(R, mu, Q=None):
+        calls['Q'] += Q is not None
+        return multipole(R, mu, Q)
+    monkeypatch.setattr(magnet_array, '_multipole', counting)
+    dipole_pairs = MagnetArray._dipole_pairs
+
+    def counting_pairs(self, P, k):
+        calls['dipole'] += P.shape[1]
+        return dipole_pairs(self, P, k)
+    monkeypatch.setattr(MagnetArray, '_dipole_pairs', counting_pairs)
+
+    rng = np.random.RandomState(0)
+    M = 200
+    magnets = [CylinderMagnet(1, 0.5, 0.2, t) for t in rng.uniform(0, np.pi, M)]
+    positions = rng.uniform(-10, 10, (M, 3))
+    x, y, z = rng.uniform(-60, 60, (3, 2000))
+    exact = np.array(MagnetArray(magnets, positions, tol=0).field(x, y, z))
+    assert calls == {'Q': 0, 'dipole': 0}
+    # the field scale of the magnets at each point, what tol is relative to
+    d = np.sqrt(((np.array([x, y, z])[:, :, None] - positions.T[:, None, :])**2).sum(0))
+    scale = (np.pi*0.5**2*0.2/d**3).sum(1)
+    for tol in (1e-3, 1e-2, 1e-1):
+        H = np.array(MagnetArray(magnets, positions, tol=tol).field(x, y, z))
+        assert np.all(abs(H - exact).max(0) <= tol * scale)
+    # the group and single-dipole terms did the work
+    assert calls['Q'] > 0 and calls['dipole'] > 0
+
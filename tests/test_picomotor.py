@@ -0,0 +1,45 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+pytest.importorskip('serial')
+
+from cep_backend import SimulatedBackend, WedgePlant, SimClock
+from picomotor import PicomotorQueue
+
+
+@pytest.fixture
+def setup():
+    plant = WedgePlant(velocity=100., noise=0., clock=SimClock())
+    backend = SimulatedBackend(plant)
+    pico = PicomotorQueue(backend.serial_port())
+    pico.init_delay = backend.init_delay
+    yield plant, pico
+    pico.stop()
+    backend.close()
+
+
+def test_moves_resolve_once_the_motor_stopped(setup):
+    plant, pico = setup
+    pico.initialise(150, 0, 2000).result(5)
+    for target in (100, 200):
+        assert pico.move(100).result(10) == 100
+        assert plant.position() == target
+        assert not plant.moving()
+
+
+def test_queued_moves_are_merged(setup):
+    plant, pico = setup
+    pico.initialise(150, 0, 2000).result(5)
+    pico.send('VEL A1 0=2000')      # keep the worker busy while the moves queue up
+    futures = [pico.move(10) for i in range(5)]
+    # each future gives the size of the merged move it went out with
+    assert all(f.result(10) in (10, 20, 30, 40, 50) for f in futures)
+    assert plant.position() == 50
+
+
+def test_query_reply_after_echoed_setup(setup):
+    plant, pico = setup
+    pico.initialise(150, 0, 2000).result(5)
+    assert pico.query('MD?').result(5) == '1'
@@ -0,0 +1,111 @@
+"""
+Wedge feedback controllers of CEPfastloop.
+
+A controller turns the error of the AOM voltage, setpoint minus the measured mean
+(mV), into the number of picomotor steps to move the wedge by on this tick; positive
+steps move the wedge in and raise the voltage. CEPfastloop calls update once per
+tick while feedback is enabled and reset when it is switched off:
+
+    controller = PIController(kp=0.2, ki=0.02, deadband=20, max_steps=50)
+    steps = controller.update(setpoint - mean, lockrange, dt)
+
+bench_feedback runs them against the simulated plant or recorded logs.
+"""
+
+import numpy as np
+
+
+class Controller(object):
+    """ Interface of the wedge controllers """
+
+    name = 'none'
+
+    def reset(self):
+        """ forget the state, feedback was switched off """
+        pass
+
+    def update(self, error, lockrange, dt):
+        """ steps to move for error (mV) with the lockrange (mV) set in the GUI, dt (s)
+        after the previous update """
+        return 0
+
+
+class BangBangController(Controller):
+    """ The original CEPfastloop feedback: once the error leaves the lockrange, move
+    stepsize steps per tick for up to burst ticks, until the voltage crossed the
+    setpoint """
+
+    name = 'bang-bang'
+
+    def __init__(self, stepsize=20, burst=15):
+        self.stepsize = stepsize
+        self.burst = burst
+        self.reset()
+
+    def reset(self):
+        self.active = 0     # ticks of moving left, the sign is the direction
+
+    def update(self, error, lockrange, dt):
+        if error <= -lockrange:
+            self.active = -self.burst
+        if error >= lockrange:
+            self.active = self.burst
+        # keep moving until the setpoint is reached again, otherwise the voltage
+        # hovers at the edge of the lockrange with the feedback constantly on
+        steps = 0
+        if self.active > 0:
+            self.active -= 1
+            steps = self.stepsize
+            if error < 0:
+                self.active = 0
+        elif self.active < 0:
+            self.active += 1
+            steps = -self.stepsize
+            if error > 0:
+                self.active = 0
+        return steps
+
+
+class PIController(Controller):
+    """ PID on the error in mV, giving steps per tick: kp (steps/mV), ki (steps/mV/s),
+    kd (steps s/mV).
+
+    Errors within deadband (mV) count as zero, so the wedge rests while the lock is
+    fine. Moves are limited to max_steps per tick, and the integral stops growing
+    while the output is at that limit (anti-windup). Fractions of a step are carried
+    over to the next tick instead of being lost to rounding """
+
+    name = 'PI'
+
+    def __init__(self, kp=0.2, ki=0.02, kd=0., deadband=20., max_steps=50):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.deadband = deadband
+        self.max_steps = max_steps
+        self.reset()
+
+    def reset(self):
+        self.integral = 0.
+        self.residual = 0.
+        self._last_error = None
+
+    def update(self, error, lockrange, dt):
+        if abs(error) <= self.deadband:
+            error = 0.
+        else:
+            error -= np.sign(error) * self.deadband
+        derivative = 0. if self._last_error is None or dt <= 0 else (error - self._last_error) / dt
+        self._last_error = error
+        integral = self.integral + error * dt
+        output = self.kp * error + self.ki * integral + self.kd * derivative
+        limited = float(np.clip(output, -self.max_steps, self.max_steps))
+        if limited == output or np.sign(error) != np.sign(output):
+            self.integral = integral
+        if error == 0:
+            self.residual = 0.
+            return 0
+        output = limited + self.residual
+        steps = int(round(output))
+        self.residual = output - steps
+        return steps